@@ -0,0 +1,76 @@
+"""
+Micro-benchmark: comment handling of `process_raw_node` (code line count
+without comments) and `rm_docstring.remove_docstring` on large, heavily
+commented Java and C# files
+
+    PYTHONPATH=./:./src python benchmark/bench_comment_lines.py --n_method 200 --n_comments 50
+"""
+import os
+import time
+import argparse
+
+from tree_sitter import Language, Parser
+from codetext.parser import JavaParser, CsharpParser
+
+from src.utils import process_raw_node
+from src.postprocess.rm_docstring.rm_docstring import remove_docstring
+
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LANGUAGES = {
+    # name: (tree-sitter language, codetext parser, method signature)
+    'java': ('java', JavaParser, 'public int method{idx}(int a, int b)'),
+    'c_sharp': ('c_sharp', CsharpParser, 'public int Method{idx}(int a, int b)'),
+}
+
+
+def make_source(signature, n_method, n_comments):
+    """A class of methods with a doc comment, line comments and block comments"""
+    lines = ['public class Sample {']
+    for idx in range(n_method):
+        lines.append('    /**')
+        lines.append(f'     * Compute the value number {idx} from two numbers.')
+        lines.append('     */')
+        lines.append(f'    {signature.format(idx=idx)} {{')
+        lines.append('        int total = a;')
+        for cmt_idx in range(n_comments):
+            lines.append(f'        // add the step {cmt_idx} to the running total')
+            if cmt_idx % 5 == 0:
+                lines.append(f'        /* the step {cmt_idx} is also')
+                lines.append('           multiplied by the second number */')
+            lines.append(f'        total = total + b * {cmt_idx}; // trailing note {cmt_idx}')
+        lines.append('        return total;')
+        lines.append('    }')
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_method', type=int, default=200)
+    parser.add_argument('--n_comments', type=int, default=50, help='Number of comments per method')
+    parser.add_argument('--n_repeat', type=int, default=3)
+    opt = parser.parse_args()
+
+    for name, (language, parser_class, signature) in LANGUAGES.items():
+        ast_parser = Parser()
+        ast_parser.set_language(Language(os.path.join(ROOT_PATH, 'tree-sitter', f'{language}.so'), language))
+        source = make_source(signature, opt.n_method, opt.n_comments)
+        code_bytes = bytes(source, 'utf8')
+        tree = ast_parser.parse(code_bytes)
+        metadata = {'repo': 'owner/repo', 'path': 'Sample', 'language': name}
+
+        start = time.perf_counter()
+        for _ in range(opt.n_repeat):
+            records = list(process_raw_node(tree, code_bytes, parser_class(), metadata))
+        raw_node_time = (time.perf_counter() - start) / opt.n_repeat
+
+        start = time.perf_counter()
+        for _ in range(opt.n_repeat):
+            for record in records:
+                remove_docstring(record['code'], record['comment'])
+        remove_time = (time.perf_counter() - start) / opt.n_repeat
+
+        print(f'{name:>8}: {len(source) / 1024:.0f} KB, {len(records)} methods | '
+              f'process_raw_node {raw_node_time:.3f}s | remove_docstring {remove_time:.3f}s')
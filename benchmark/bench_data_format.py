@@ -0,0 +1,53 @@
+"""
+Micro-benchmark: per-sample overhead of loading the data format
+
+    PYTHONPATH=./:./src python benchmark/bench_data_format.py --data_format ./data/format/thestack.yaml
+"""
+import os
+import time
+import argparse
+
+import yaml
+
+from src.utils.reader import load_data_format
+
+
+def per_sample_yaml(samples, data_format_path):
+    """Previous behaviour: load .yaml for every sample"""
+    for data in samples:
+        assert os.path.exists(data_format_path)
+        with open(data_format_path, 'r') as stream:
+            data_format = yaml.safe_load(stream)
+        metadata = {"repo": data[data_format["repo"]], 
+                    "path": data[data_format["path"]], 
+                    "language": data[data_format["language"]]}
+        for key in data_format.keys():
+            if key not in ['code', 'repo', 'path', 'language']:
+                metadata[key] = data[data_format[key]]
+        code = data[data_format["code"]]
+
+
+def compiled_fields(samples, data_format_path):
+    """Current behaviour: compile .yaml once into field accessors"""
+    code_key, data_fields = load_data_format(data_format_path)
+    for data in samples:
+        metadata = {key: data[source_key] for key, source_key in data_fields}
+        code = data[code_key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_format', type=str, default='./data/format/thestack.yaml')
+    parser.add_argument('--n_sample', type=int, default=20000)
+    opt = parser.parse_args()
+    
+    with open(opt.data_format, 'r') as stream:
+        data_format = yaml.safe_load(stream)
+    sample = {source_key: 'x' for source_key in data_format.values()}
+    samples = [sample] * opt.n_sample
+    
+    for fn in [per_sample_yaml, compiled_fields]:
+        start = time.perf_counter()
+        fn(samples, opt.data_format)
+        elapsed = time.perf_counter() - start
+        print('%-16s %10.3f us/sample' % (fn.__name__, elapsed / opt.n_sample * 1e6))
@@ -0,0 +1,81 @@
+"""
+Micro-benchmark: docstring parsing of `extract_docstring`, exhaustive (every
+style of `STYLE_MAP[language]`) vs. detected style first (`parse_docstring`)
+
+    PYTHONPATH=./:./src python benchmark/bench_docstring_style.py --n_docstring 2000
+"""
+import time
+import argparse
+
+from docstring_parser.common import ParseError
+
+from src.utils.utils import STYLE_MAP, parse, parse_docstring
+
+
+DOCSTRINGS = {
+    'python': [
+        'Add two numbers.\n\n:param a: first number\n:param b: second number\n:return: the sum',
+        'Add two numbers.\n\nArgs:\n    a (int): first number\n    b (int): second number\n\n'
+        'Returns:\n    int: the sum',
+        'Add two numbers.\n\nParameters\n----------\na : int\n    first number\nb : int\n'
+        '    second number\n\nReturns\n-------\nint\n    the sum',
+        'Add two numbers.\n\n@param a: first number\n@param b: second number\n@return: the sum',
+        'Add two numbers and return the sum of them.',
+    ],
+    'c_sharp': [
+        '<summary>Add two numbers.</summary>\n<param name="a">first number</param>\n'
+        '<returns>the sum</returns>',
+        'Add two numbers.\n@param a first number\n@return the sum',
+        'Add two numbers and return the sum of them.',
+    ],
+    'java': [
+        'Add two numbers.\n@param a first number\n@param b second number\n@return the sum',
+    ],
+}
+
+
+def parse_exhaustive(docstring, styles):
+    """Previous selection: parse with every style, keep the most meta"""
+    rets = []
+    try:
+        for style in styles:
+            try:
+                rets.append(parse(docstring, style))
+            except ParseError:
+                pass
+    except Exception:
+        return None
+    rets = sorted(rets, key=lambda d: len(d.meta), reverse=True)
+    return rets[0] if rets else None
+
+
+def summarize(ret):
+    if ret is None:
+        return None
+    return (ret.short_description, ret.long_description,
+            [(item.args, item.description) for item in ret.meta])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_docstring', type=int, default=2000, help='Number of docstrings per language')
+    parser.add_argument('--n_repeat', type=int, default=3)
+    opt = parser.parse_args()
+
+    for language, samples in DOCSTRINGS.items():
+        styles = STYLE_MAP[language]
+        docstrings = [samples[idx % len(samples)] for idx in range(opt.n_docstring)]
+
+        exhaustive_time = detect_time = float('inf')
+        for _ in range(opt.n_repeat):
+            start = time.perf_counter()
+            expected = [parse_exhaustive(docstring, styles) for docstring in docstrings]
+            exhaustive_time = min(exhaustive_time, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            results = [parse_docstring(docstring, styles) for docstring in docstrings]
+            detect_time = min(detect_time, time.perf_counter() - start)
+
+        same = all(summarize(a) == summarize(b) for a, b in zip(expected, results))
+        print(f'{language:>8}: {len(styles)} styles | exhaustive {len(docstrings) / exhaustive_time:,.0f} docstrings/s | '
+              f'detected {len(docstrings) / detect_time:,.0f} docstrings/s | same result: {same}')
@@ -0,0 +1,73 @@
+"""
+Micro-benchmark: records/s of the JSON patterns used by each stage, standard
+`json` module vs `src/utils/io.py` (orjson/msgspec when installed)
+
+    PYTHONPATH=./:./src python benchmark/bench_json_codec.py --data_path ./data/raw/python_merge_0.jsonl
+"""
+import json
+import time
+import argparse
+
+from src.utils import io
+
+
+def make_record(idx):
+    """Synthetic function-level record (see `data/README.md`)"""
+    code_tokens = ['def', f'func_{idx}', '(', 'a', ',', 'b', ')', ':'] + ['return', 'a', '+', 'b'] * 20
+    docstring_tokens = ['Add', 'two', 'numbers', 'together', '.'] * 5
+    return {
+        'repo': 'owner/repo', 'path': f'src/module_{idx}.py', 'language': 'Python',
+        'license': ['mit'], 'identifier': f'func_{idx}',
+        'parameters': {'a': None, 'b': None}, 'return_type': None,
+        'original_docstring': ' '.join(docstring_tokens),
+        'docstring': ' '.join(docstring_tokens), 'docstring_tokens': docstring_tokens,
+        'short_docstring': 'Add two numbers together.', 'short_docstring_tokens': docstring_tokens[:5],
+        'comment': [], 'code': ' '.join(code_tokens), 'code_tokens': code_tokens,
+        'docstring_params': {'returns': [], 'raises': [], 'params': [], 'outlier_params': [], 'others': []},
+    }
+
+
+STAGES = {
+    # name: (fields decoded by the stage, None for the whole record)
+    'reader': None,
+    'license_filter': ['license', 'docstring_tokens', 'code_tokens'],
+    'deduplication': ['id', 'code_tokens'],
+    'analysis_raw': ['original_docstring'],
+}
+
+
+def run(fn, items, n_repeat):
+    start = time.perf_counter()
+    for _ in range(n_repeat):
+        for item in items:
+            fn(item)
+    return len(items) * n_repeat / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', type=str, default=None, help='.jsonl file (synthetic records if not set)')
+    parser.add_argument('--n_sample', type=int, default=20000)
+    parser.add_argument('--n_repeat', type=int, default=3)
+    opt = parser.parse_args()
+
+    if opt.data_path:
+        with open(opt.data_path, 'rb') as file:
+            lines = [line for _, line in zip(range(opt.n_sample), file)]
+        records = [json.loads(line) for line in lines]
+    else:
+        records = [make_record(idx) for idx in range(opt.n_sample)]
+        lines = [json.dumps(item).encode('utf8') + b'\n' for item in records]
+
+    print('orjson: %s | msgspec: %s' % (io._ORJSON_AVAILABLE, io._MSGSPEC_AVAILABLE))
+    print('%-16s %14s %14s %8s' % ('stage', 'json rec/s', 'io rec/s', 'speedup'))
+
+    before = run(lambda item: (json.dumps(item, ensure_ascii=False) + '\n').encode('utf8'), records, opt.n_repeat)
+    after = run(lambda item: io.dumps_bytes(item) + b'\n', records, opt.n_repeat)
+    print('%-16s %14.0f %14.0f %7.1fx' % ('writer', before, after, after / before))
+
+    for name, fields in STAGES.items():
+        decode = io.loads if fields is None else io.get_decoder(fields)
+        before = run(json.loads, lines, opt.n_repeat)
+        after = run(decode, lines, opt.n_repeat)
+        print('%-16s %14.0f %14.0f %7.1fx' % (name, before, after, after / before))
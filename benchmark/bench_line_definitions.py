@@ -0,0 +1,60 @@
+"""
+Micro-benchmark: inline extraction (`get_line_definitions`) on heavily
+commented Python files, the time per comment should stay flat as the
+number of comments per function grows
+
+    PYTHONPATH=./:./src python benchmark/bench_line_definitions.py --n_comments 10 100 1000
+"""
+import os
+import time
+import argparse
+
+from tree_sitter import Language, Parser
+from codetext.parser import PythonParser
+
+from src.utils import get_line_definitions
+
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_source(n_function, n_comments):
+    """Functions alternating comment blocks (1 or 2 lines) and statements"""
+    lines = []
+    for fn_idx in range(n_function):
+        lines.append(f'def func_{fn_idx}(a, b):')
+        for idx in range(n_comments):
+            lines.append(f'    # Update the accumulated value with the step number {idx}')
+            if idx % 3 == 0:
+                lines.append(f'    # and keep the previous value for the next step')
+            lines.append(f'    a = a + b * {idx}')
+            lines.append(f'    b = a - {idx}')
+        lines.append('    return a')
+        lines.append('')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_comments', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Number of comment blocks per function')
+    parser.add_argument('--n_function', type=int, default=5)
+    parser.add_argument('--n_repeat', type=int, default=3)
+    opt = parser.parse_args()
+
+    ast_parser = Parser()
+    ast_parser.set_language(Language(os.path.join(ROOT_PATH, 'tree-sitter', 'python.so'), 'python'))
+    language_parser = PythonParser()
+
+    print(f"{'comments/function':>18} {'file KB':>8} {'samples':>8} {'seconds':>8} {'us/comment':>11}")
+    for n_comments in opt.n_comments:
+        source = make_source(opt.n_function, n_comments)
+        tree = ast_parser.parse(bytes(source, 'utf8'))
+        metadata = {'repo': 'owner/repo', 'path': 'module.py', 'language': 'Python'}
+
+        start = time.perf_counter()
+        for _ in range(opt.n_repeat):
+            samples = list(get_line_definitions(tree, source, language_parser, metadata.copy()))
+        elapsed = (time.perf_counter() - start) / opt.n_repeat
+        print(f'{n_comments:>18} {len(source) / 1024:>8.0f} {len(samples):>8} {elapsed:>8.3f} '
+              f'{elapsed / (opt.n_function * n_comments) * 1e6:>11.1f}')
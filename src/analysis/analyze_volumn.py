@@ -6,6 +6,8 @@ from tqdm import tqdm
 # from tqdm.contrib.concurrent import process_map
 from time import time
 
+from utils.io import get_decoder
+
 class Volumn_analyzer:
     def __init__(self, cores, languages= None, analyze_attrs= None, save_folder= None):
         if languages is None:
@@ -40,17 +42,20 @@ class Volumn_analyzer:
         rs['volumn'].append(len(dataset))
         if "raw" in datafile:
             rs['none_docstring'] = 0
+            decode = get_decoder(['original_docstring'])
             for dp in dataset:
                 try:
-                    dp = json.loads(dp)
+                    dp = decode(dp)
                 except:
                     continue
                 if dp['original_docstring'] is None or dp['original_docstring'].strip() == "":
                     rs['none_docstring'] += 1
             return rs
         
+        # only decode the analyzed attributes
+        decode = get_decoder([attr for attr in self.attrs if attr != 'distribution_docstring_attributes'] + ['docstring_params'])
         for dp in dataset:
-            dp = json.loads(dp)
+            dp = decode(dp)
             for attr in self.attrs:
                 if ((attr != 'distribution_docstring_attributes' and attr not in dp) or             # Some attr is missing in some language
                    (attr == 'distribution_docstring_attributes' and "docstring_params" not in dp)): # e.g. Golang do not have short_docstring_tokens 
@@ -1,11 +1,12 @@
 import random
 import hashlib
-import json
 from tqdm import tqdm
 
 from argparse import ArgumentParser
 import multiprocessing as mp
 
+from utils.io import dump_line, get_decoder
+
 
 def jaccard_similarity(code1, code2, num_hash_functions=100) -> float:
     """Compute the Jaccard similarity of two code snippets."""
@@ -44,7 +45,7 @@ def minhash_signature(tokens, num_hash_functions=100):
 
 def _compute_min_hash(element):
     try:
-        value = json.loads(element)
+        value = get_decoder(['id', 'code_tokens'])(element)
     except Exception:
         print(element)
     code = value['code_tokens']
@@ -104,7 +105,7 @@ if __name__ == '__main__':
     # First load all data in target path into 
     target_hash = []
     print("Load target set", opt.target_path)
-    with open(opt.target_path, 'r') as file:
+    with open(opt.target_path, 'r', encoding='utf8') as file:
         dataset = list(file)
         for _, min_hash in tqdm(minhash_iter(dataset), total=len(dataset)):
             target_hash.append(min_hash)
@@ -114,8 +115,8 @@ if __name__ == '__main__':
     # Cal minhash and compare
     print("Load dataset")
     chunk_size = 100000
-    writer = open(f'./{opt.save_name}_deduplicate.jsonl', "w")
-    with open(opt.data_path, 'r') as file:
+    writer = open(f'./{opt.save_name}_deduplicate.jsonl', "w", encoding='utf8')
+    with open(opt.data_path, 'r', encoding='utf8') as file:
         dataset = list(file)
         duplicate_list = []
         for index, min_hash in tqdm(minhash_iter(dataset), total=len(dataset)):
@@ -125,6 +126,5 @@ if __name__ == '__main__':
                     duplicate_list.append(index)
 
     for item in duplicate_list:
-        json.dump({'id': item}, writer)
-        writer.write('\n')
+        dump_line({'id': item}, writer)
     
\ No newline at end of file
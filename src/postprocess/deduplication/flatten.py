@@ -1,7 +1,7 @@
 from datasets import load_dataset
 from codetext.parser import *
 from codetext.parser.language_parser import tokenize_code
-from codetext.utils import parse_code
+from utils.utils import parse_many
 import json
 from tqdm import tqdm
 
@@ -25,12 +25,14 @@ elif language == 'java':
 elif language == 'cpp':
     parser = CppParser
 
-for data in tqdm(humaneval_test, total=len(humaneval_test)):
+codes = [data['declaration'] + data['canonical_solution'] for data in humaneval_test] # only for java
+trees = parse_many(codes, language)
+
+for data, code, tree in tqdm(zip(humaneval_test, codes, trees), total=len(humaneval_test)):
     idx = data['task_id']
-    code = data['declaration'] + data['canonical_solution'] # only for java
     # docstring = data['prompt']
     
-    node = parse_code(code, language).root_node
+    node = tree.root_node
     fn = parser.get_function_list(node)
     
     if len(fn) > 0:
@@ -1,4 +1,3 @@
-import json
 import argparse
 from itertools import tee
 from tqdm import tqdm
@@ -6,6 +5,8 @@ from typing import List, Iterable, Dict
 from datasketch import MinHash, MinHashLSH
 import multiprocessing as mp
 
+from utils.io import dump_line, get_decoder
+
 def ngrams(sequence: List[str], n: int, min_ngram_size: int = 5) -> Iterable:
     """
     Code taken from NLTK, without padding.
@@ -52,9 +53,10 @@ def calculate_minhash(idx, tokens, num_perm=128):
 
 def calculate_minhash_iter(dataset, ngram):
     args = []
+    decode = get_decoder(['id', 'task_id', 'problem_id', 'code_tokens'])
     for item in dataset:
         try:
-            item = json.loads(item)
+            item = decode(item)
         except Exception:
             continue
         
@@ -134,10 +136,9 @@ def deduplicate(
         print("Not find any duplicated sample")
     else:
         # TODO: save duplicate_info as 
-        with open(f"./{save_name}", 'w') as writer:
+        with open(f"./{save_name}", 'w', encoding='utf8') as writer:
             for item in duplicate_info:
-                json.dump(item, writer)
-                writer.write('\n')
+                dump_line(item, writer)
 
 
 def args_parse():
@@ -157,9 +158,9 @@ if __name__ == '__main__':
     mp.set_start_method("fork")
     
     print("Deduplication for", opt.set1)
-    with open(opt.set1, 'r') as file1:
+    with open(opt.set1, 'r', encoding='utf8') as file1:
         src = list(file1)
-    with open(opt.set2, 'r') as file2:
+    with open(opt.set2, 'r', encoding='utf8') as file2:
         tgt = list(file2)
         
     deduplicate(src, tgt, opt.threshold, opt.num_perm, opt.n_gram, opt.save_name)
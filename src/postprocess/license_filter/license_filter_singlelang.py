@@ -7,6 +7,7 @@ import pickle
 import logging
 from analysis.analyser import Analyser , repeat
 from utils.decorators import timing_decorator
+from utils.io import get_decoder
 from multiprocessing import Queue, Pool, Process
 import multiprocessing
 from typing import List
@@ -71,6 +72,8 @@ class LicenseFilter(Analyser):
                         #    "valid_special_char_len", 
                         #    "valid_nodes"
                            ]
+        # fields read by the conditions, the rest of a sample is not decoded
+        self.condition_fields = ["license", "docstring_tokens", "code_tokens"]
         if self.parallel:
             self.queue = Queue()
             self.multi_threads_vars = {"num_original": multiprocessing.Value("i", 0)}
@@ -110,14 +113,14 @@ class LicenseFilter(Analyser):
 
     def not_a_valid_sample(self, line):
         try:
-            data = json.loads(line)
+            data = get_decoder(self.condition_fields)(line)
             try:
                 methods = [getattr(self, condition) for condition in self.conditions]
                 return any([not method(data) for method in methods])
             except KeyError as e :
                 print(e)
                 return False
-        except json.decoder.JSONDecodeError as e:
+        except JSONDecodeError as e:
             print(e)
             return False
 
@@ -136,8 +139,8 @@ class LicenseFilter(Analyser):
             else:
                 self.single_thread_vars["num_original"] += 1
             try:
-                data = json.loads(line)
-            except json.decoder.JSONDecodeError as e:
+                data = get_decoder(self.condition_fields)(line)
+            except JSONDecodeError as e:
                 print(e)
             
             is_valid_sample = True
@@ -162,7 +165,7 @@ class LicenseFilter(Analyser):
 
     def not_valid_license(self, line):
         try:
-            data = json.loads(line)
+            data = get_decoder(["license"])(line)
             try:
                 non_valid = [x for x in data["license"] if x not in self.valid_licenses]
                 if non_valid:
@@ -176,7 +179,7 @@ class LicenseFilter(Analyser):
             except KeyError as e :
                 print(e)
                 return True
-        except json.decoder.JSONDecodeError as e:
+        except JSONDecodeError as e:
             print(e)
             return True
 
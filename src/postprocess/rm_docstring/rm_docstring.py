@@ -2,17 +2,19 @@ from argparse import ArgumentParser
 import os
 import pandas as pd
 import glob
-import json
 from tqdm import tqdm
 from multiprocessing import Pool
 
+from utils.io import dump_line, loads
+from utils.spans import find_comment_spans, remove_spans
+
 
 def remove_docstring(code, comment_list):
     assert type(code) == str
     
     # code_remove_comment = code.replace(docstring, '')
-    for cmt in comment_list:
-        code = code.replace(cmt, '')
+    # comments are in source order, locate them in one scan then cut them out
+    code = remove_spans(code, find_comment_spans(code, comment_list))
         
     lines = [line for line in code.splitlines() if line.strip()]
     code = '\n'.join(lines)
@@ -35,11 +37,11 @@ def load_data(args):
     print(args)
     file_path, save_path, idx = args
     name = os.path.basename(os.path.normpath(file_path))
-    with open(save_path, 'a') as writer:
-        with open(file_path, 'r') as infile:
+    with open(save_path, 'a', encoding='utf8') as writer:
+        with open(file_path, 'r', encoding='utf8') as infile:
             dataset = list(infile)
             for line in tqdm(dataset, position=idx, desc=f"Processing: {name}"):
-                data = json.loads(line)
+                data = loads(line)
                 
                 original_code = data['code']
                 cmts = data['comment']
@@ -48,8 +50,7 @@ def load_data(args):
                 data['code'] = code
                 data['original_string'] = original_code
             
-                json.dump(data, writer)
-                writer.write('\n')
+                dump_line(data, writer)
             
 
 def parse_args():
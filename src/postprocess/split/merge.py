@@ -8,9 +8,10 @@ from codetext.clean import remove_comment_delimiters
 
 import nltk
 import hashlib
-import json
 import csv
 
+from utils.io import dump_line, loads
+
 def get_first_sentence(paragraph):
     """
     Returns the first sentence of a given paragraph of text.
@@ -75,12 +76,12 @@ def merge_files(args):
     
     metadata = []
     
-    with open(output_filename, 'w') as outfile:
+    with open(output_filename, 'w', encoding='utf8') as outfile:
         for filename in tqdm(file_list, position=idx, desc=f'Merging files in {data_path}', leave=False):
-            with open(filename, 'r') as infile:
+            with open(filename, 'r', encoding='utf8') as infile:
                 dataset = list(infile)
                 for line in dataset:
-                    data = json.loads(line)
+                    data = loads(line)
                     
                     code = data['code']
                     repo = data['repo']
@@ -97,8 +98,7 @@ def merge_files(args):
                     # for metadata.csv
                     metadata.append([idx, repo, code_len, docs_len])
                     
-                    json.dump(data, outfile)
-                    outfile.write('\n')
+                    dump_line(data, outfile)
     
     fields = ['ID', 'Repo Name', 'Code Length', 'Docs Length']
     # Open the CSV file and write the data to it
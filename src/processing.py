@@ -2,24 +2,44 @@ import os
 import argparse
 import time
 import logging
-import json
-import yaml
 from tqdm import tqdm
 from pathlib import Path
+from functools import partial
 
+import queue
 import multiprocessing
 
-from datasets import load_dataset
+from datasets import concatenate_datasets, load_dataset
 from tree_sitter import Parser, Language
 
 from codetext.parser import *
-from codetext.utils import build_language
 from src.utils.logger import create_logger
+from src.utils.limits import FileTimeout, parse_with_limits, time_limit
+from src.utils.cache import DocstringCache, ExtractionCache, get_blob_hexsha, get_parser_version
+from src.utils import grammar
+from src.utils.checkpoint import Manifest, get_signature
+from src.utils.profiler import StageProfiler
+from src.utils.scheduler import order_by_cost, report_utilization, split_by_size
+from src.utils.shared import SharedLineIndex
+from src.utils.reader import get_jsonl_shards, get_parquet_shards, is_parquet,\
+    load_data_format, read_jsonl_file, read_jsonl_shard, read_parquet_shard
+from src.utils.writer import QueueWriter, RotatingWriter, get_writer, run_writer_process, write_shard_index
 from src.utils import extract_node, get_line_definitions,\
-    get_node_definitions, process_raw_node, write_jsonl
+    get_node_definitions, normalize_language, process_raw_node
 
 
 ROOT_PATH = str(Path(__file__).parents[1])
+logger = logging.getLogger()
+
+SUPPORTED_LANGUAGES = ['python', 'java', 'javascript', 'go', 'ruby', 'rust', 'php', 'c', 'cpp', 'c_sharp']
+
+# File extension (e.g. `ext` field of The Stack) to language, used when the
+# `language` field of a record is missing or not supported
+EXTENSION_LANGUAGES = {
+    'py': 'python', 'java': 'java', 'js': 'javascript', 'go': 'go', 'rb': 'ruby',
+    'rs': 'rust', 'php': 'php', 'c': 'c', 'h': 'c', 'cpp': 'cpp', 'cc': 'cpp',
+    'cxx': 'cpp', 'hpp': 'cpp', 'hh': 'cpp', 'cs': 'c_sharp',
+}
 
 
 def load_json(filepath):
@@ -35,70 +55,229 @@ def main(opt):
         n_worker = multiprocessing.cpu_count()
     else: 
         n_worker = opt.n_core
+    opt.languages = get_languages(opt)
+    # re-filtering raw samples does not parse
+    opt.grammar_languages = None if opt.cons_from_raw else prepare_grammars(opt.languages)
         
     if opt.load_from_file:
         logger.info("============ Load dataset from file %s ... ============" % opt.data_path)
-        if not str(opt.data_path).endswith(('json', 'jsonl')):
-            raise ValueError("Not found `json` or `jsonl` file, instead found %s" % opt.data_path)
-        
-        with open(opt.data_path, 'r') as json_file:
-            dataset = list(json_file)
+        if is_parquet(opt.data_path):
+            # Each worker reads its own row group(s) directly
+            dataset = get_parquet_shards(opt.data_path, opt.n_sample)
+        elif opt.shared_memory and str(opt.data_path).endswith(('json', 'jsonl')):
+            # Line offsets in shared memory, workers memory-map the file
+            dataset = SharedLineIndex(opt.data_path, opt.n_sample)
+        elif str(opt.data_path).endswith(('json', 'jsonl')):
+            # Stream the file: each worker only reads and parses its own byte range
+            dataset = get_jsonl_shards(opt.data_path, opt.n_split, opt.n_sample)
+        else:
+            raise ValueError("Not found `json`, `jsonl` or `parquet` file, instead found %s" % opt.data_path)
+        logger.info("Load dataset done. Number of %s: %i ============" % 
+                    ('line' if isinstance(dataset, SharedLineIndex) else 'shard', len(dataset)))
             
     elif opt.cons_from_raw:
         logger.info("============ Load dataset from dir %s ... ============" % opt.data_path)
         assert os.path.exists(opt.data_path) and os.path.isdir(opt.data_path)
-        dataset = [os.path.join(opt.data_path, item) for item in os.listdir(opt.data_path)]
+        if opt.level not in ['function', 'class']:
+            raise ValueError("--cons_from_raw re-filters raw function or class samples, "
+                             "use --level function or --level class")
+        # re-filter raw samples (`<level>/raw/*.jsonl`) without parsing
+        dataset = [os.path.join(opt.data_path, item) for item in sorted(os.listdir(opt.data_path))
+                   if item.endswith(('.jsonl', '.jsonl.gz', '.jsonl.zst'))]
 
     else:
         logger.info("============ Load dataset from HuggingFace %s ... ============" % opt.data_path)
-        dataset = load_dataset("bigcode/the-stack-dedup", data_dir=f"data/{opt.language.replace('_', '-')}", split='train', cache_dir=opt.data_path)
-    logger.info("Load dataset done. Number of sample: %i ============" % len(dataset))
+        if opt.languages is None:
+            raise ValueError("`--language auto` is only supported with --load_from_file, "
+                             "declare the languages to load from HuggingFace")
+        dataset = [load_dataset("bigcode/the-stack-dedup", data_dir=f"data/{language.replace('_', '-')}", split='train', cache_dir=opt.data_path)
+                   for language in opt.language]
+        dataset = dataset[0] if len(dataset) == 1 else concatenate_datasets(dataset)
+    if not opt.load_from_file:
+        logger.info("Load dataset done. Number of sample: %i ============" % len(dataset))
 
 
+    # compile data format once, workers receive it along with `opt`
+    opt.data_fields = load_data_format(opt.data_format)
+    
     # start_executor(dataset, language, save_path, split, is_file)
     logger.info("============ Start multiprocessing using %i worker ============" % n_worker)
     
     # split dataset
-    dataset_size = opt.n_sample if opt.n_sample else len(dataset)
-    index_list = range(dataset_size)
-    chunk_size = dataset_size//opt.n_split
-    if opt.cons_from_raw:
-        chunk_size = 1
+    if isinstance(dataset, SharedLineIndex):
+        # (start, end) line range, balanced by bytes
+        sizes = dataset.line_sizes()
+        jobs_list = [(job.start, job.stop) for job in split_by_size(sizes, opt.n_split)]
+        job_costs = [int(sizes[start:end].sum()) for start, end in jobs_list]
+        logger.info("Spliting %i lines of %s into %i shards" % (len(dataset), opt.data_path, len(jobs_list)))
     
-    logger.info("Spliting %i samples into %i sub-dataset with chunk size %i" % (dataset_size, opt.n_split, chunk_size))
+    elif opt.load_from_file:
+        # shard is already a (file, start, end) byte range or a (file, row group, ...)
+        # descriptor, no need to pass the dataset
+        jobs_list = dataset
+        dataset = None
+        if is_parquet(opt.data_path):
+            job_costs = [byte_size for _, _, _, byte_size in jobs_list]
+        else:
+            job_costs = [end - start for _, start, end in jobs_list]
+        logger.info("Spliting %s into %i shards" % (opt.data_path, len(jobs_list)))
     
-    jobs_list = [index_list[x:x+chunk_size] for x in range(0, dataset_size, chunk_size)]  # n set
-    args = []
-    for idx, job_index in enumerate(jobs_list):
-        args.append([dataset, job_index, opt, idx]) # opt.language, opt.save_path, idx, is_file])
-    logger.info("Total %i processes" % len(args))
+    elif opt.cons_from_raw:
+        dataset_size = opt.n_sample if opt.n_sample else len(dataset)
+        jobs_list = [range(idx, idx + 1) for idx in range(min(dataset_size, len(dataset)))]
+        job_costs = [os.path.getsize(dataset[job.start]) for job in jobs_list]
+        logger.info("Spliting %i raw files into %i sub-dataset" % (len(dataset), len(jobs_list)))
     
-    res = []
+    else:
+        dataset_size = opt.n_sample if opt.n_sample else len(dataset)
+        size_key = dict(opt.data_fields[1]).get('size')
+        
+        if size_key in dataset.column_names:
+            # balance the chunks by file size instead of number of files
+            sizes = dataset.data.column(size_key).to_numpy()[:dataset_size]
+            jobs_list = split_by_size(sizes, opt.n_split)
+            job_costs = [int(sizes[job.start:job.stop].sum()) for job in jobs_list]
+            logger.info("Spliting %i samples into %i sub-dataset by `%s`" % (dataset_size, len(jobs_list), size_key))
+        
+        else:
+            index_list = range(dataset_size)
+            chunk_size = max(1, dataset_size//opt.n_split)
+            logger.info("Spliting %i samples into %i sub-dataset with chunk size %i" % (dataset_size, opt.n_split, chunk_size))
+            jobs_list = [index_list[x:x+chunk_size] for x in range(0, dataset_size, chunk_size)]  # n set
+            job_costs = [len(job) for job in jobs_list]
+    
+    profiler = StageProfiler()
     if opt.debug: # for debuging
-        processing(dataset, jobs_list[0], opt)
+        result, outputs = processing(dataset, jobs_list[0], opt, profiler=profiler)
+        res = [result]
+        index_entries = [get_index_entry(entry, 1, opt.save_path) for entry in outputs]
+    
     else:
-        executor = multiprocessing.Pool(n_worker)
-        # executor.starmap(processing, args)
-        for result in tqdm(executor.starmap(processing, args), total=len(args)):
+        # Skip shards completed by a previous run
+        raw_files = dataset if opt.cons_from_raw else None
+        # the output layout is part of it, the outputs of completed shards are kept as they are
+        signature = get_signature(opt.level, opt.languages, opt.data_path, opt.n_sample, raw_files, jobs_list,
+                                  opt.output_format, opt.compression, opt.max_shard_records, opt.max_shard_bytes)
+        manifest = Manifest(os.path.join(opt.save_path, f'manifest_{opt.level}.jsonl'), signature, opt.resume)
+        
+        args, costs = [], []
+        for idx, job_index in enumerate(jobs_list):
+            if manifest.is_completed(idx):
+                continue
+            # the dataset is handed to each worker once (see `init_worker`)
+            args.append([job_index, opt, idx]) # opt.language, opt.save_path, idx, is_file])
+            costs.append(job_costs[idx])
+        # longest-first, then hand out one job at a time to whichever worker is free
+        args = order_by_cost(args, costs)
+        logger.info("Total %i processes" % len(args))
+        
+        writer_queue = None
+        if opt.async_writer:
+            # dedicated writer process fed by a bounded queue (see `QueueWriter`)
+            writer_queue = multiprocessing.Queue(maxsize=opt.writer_queue_size)
+            done_queue = multiprocessing.Queue()
+            writer_process = multiprocessing.Process(target=run_writer_process, args=(writer_queue, done_queue))
+            writer_process.start()
+        # shard -> result (received from the pool) / (ok, outputs) (closed by the writer process)
+        pending, written = {}, {}
+        
+        def add_written_shards(block=False):
+            """Record the shards done by both the pool and the writer process"""
+            while True:
+                try:
+                    item = done_queue.get(block=block)
+                except queue.Empty:
+                    item = None
+                if item is not None:
+                    written[item[0]] = item[1:]
+                for shard in [shard for shard in written if shard in pending]:
+                    ok, outputs = written.pop(shard)
+                    if ok:
+                        manifest.add(shard, pending.pop(shard),
+                                     [get_index_entry(entry, shard, opt.save_path) for entry in outputs])
+                    else:
+                        logger.error("Failed to write the outputs of shard %i, it will be redone on --resume" % shard)
+                        pending.pop(shard)
+                if item is None:
+                    return
+        
+        res = list(manifest.completed.values())
+        busy_time = {}
+        pool_start = time.perf_counter()
+        executor = multiprocessing.Pool(n_worker, initializer=init_worker, initargs=(opt, dataset, writer_queue))
+        for idx, result, outputs, pid, elapsed, job_profiler in tqdm(executor.imap_unordered(processing_job, args, chunksize=1), total=len(args)):
             res.append(result)
+            busy_time[pid] = busy_time.get(pid, 0) + elapsed
+            profiler.merge(job_profiler)
+            if writer_queue is None:
+                # shard outputs are already renamed to their final name at this point
+                manifest.add(idx, result, [get_index_entry(entry, idx, opt.save_path) for entry in outputs])
+            else:
+                pending[idx] = result
+                add_written_shards()
+        executor.close()
+        executor.join()
+        if writer_queue is not None:
+            writer_queue.put(None)
+            add_written_shards(block=True)
+            writer_process.join()
+        manifest.close()
+        # completed shards of this run and the resumed ones
+        index_entries = [entry for shard in sorted(manifest.outputs) for entry in manifest.outputs[shard]]
+        report_utilization(busy_time, time.perf_counter() - pool_start)
+    
+    if isinstance(dataset, SharedLineIndex):
+        dataset.close()
+    write_shard_index(opt.save_path, index_entries)
     
-    res = [sum(x) for x in zip(*res)]
     finish = time.perf_counter()
     logger.info("\n\n============ Processing done, finished in %.3f seconds ============" % (finish - start))
-    logger.info("Level {}: Total Raw {} | Filterable {} | Extractable {} \n".format(opt.level, *res))
+    n_record = 0
+    if is_multi_language(opt):
+        # results are keyed by `<language>/<level>`
+        keys = sorted({key for result in res for key in result})
+    else:
+        keys = get_levels(opt)
+    for key in keys:
+        total = [sum(x) for x in zip(*[result[key] for result in res if key in result])]
+        n_record += sum(total)
+        logger.info("Level {}: Total Raw {} | Filterable {} | Extractable {} \n".format(key, *total))
+    # only covers the shards processed by this run (not the resumed ones)
+    profiler.save(os.path.join(opt.save_path, f'profile_{opt.level}.json'), finish - start, n_record)
+
+
+# Per-process cache of {language: (tree_sitter.Parser, LanguageParser)}
+_PARSER_CACHE = {}
+# Per-process dataset (HuggingFace dataset, list of raw files, shared line
+# index or None), set once by `init_worker` instead of pickled in every job
+_DATASET = None
+# Queue of the writer process (`--async_writer`), None to write in the worker
+_WRITER_QUEUE = None
+# Per-process cache of the docstring processing, kept across shards
+_DOCSTRING_CACHE = None
 
 
-def processing(dataset, job_index, opt, idx=1): #language, save_path, idx=None, is_file=None):
-    # setup language parser
-    language = str(opt.language).lower()
-    if language == "c++": language = "cpp"
-    if language == "c#": language = "c_sharp"
+def get_parser(language):
+    """
+    Get tree-sitter parser and codetext language parser of a language,
+    build them once per process and reuse on the following calls
+    
+    Args:
+        language (str): processing language (e.g: Python, C++, C#)
+    
+    Returns:
+        Tuple[tree_sitter.Parser, LanguageParser]
+    """
+    language = normalize_language(language)
+    if language in _PARSER_CACHE:
+        return _PARSER_CACHE[language]
     
     ast_parser = Parser()
-    lang_path = os.path.join(ROOT_PATH, 'tree-sitter', f'{language}.so')
+    lang_path = get_grammar_path(language)
     if not os.path.exists(lang_path):
-        logger.info("Language %s not found | Attempt to build it" % (opt.language))
-        build_language(language)
+        # grammars are built before starting the workers (see `prepare_grammars`)
+        raise FileNotFoundError(f"Not found the {language} grammar in {lang_path}, "
+                                "build it with `python src/utils/grammar.py`")
         
     tree_language = Language(lang_path, language)
     ast_parser.set_language(tree_language)
@@ -133,113 +312,439 @@ def processing(dataset, job_index, opt, idx=1): #language, save_path, idx=None,
     else:
         raise ValueError(f'Language {language} not supported')
     
-    t_start = time.perf_counter()
-    save_path = os.path.join(opt.save_path, opt.level)
-    raw_path = os.path.join(save_path, 'raw')
-    filtered_path = os.path.join(save_path, 'filtered')
-    extracted_path = os.path.join(save_path, 'extracted')
+    _PARSER_CACHE[language] = (ast_parser, language_parser)
+    return _PARSER_CACHE[language]
+
+
+def get_grammar_path(language) -> str:
+    """Path to the tree-sitter library (bundle or .so file) of a (normalized) language"""
+    return grammar.get_grammar_path(language, os.path.join(ROOT_PATH, 'tree-sitter'))
+
+
+def prepare_grammars(languages):
+    """
+    Check the grammars of the processing languages before starting the
+    workers, which only load ready libraries. Missing grammars are built
+    from the vendored sources (see `src/utils/grammar.py`) once, here.
+
+    Args:
+        languages (List[str]): normalized languages, None for `auto`
+
+    Returns:
+        List[str]: languages with a grammar (records of the others are
+            skipped with `auto`)
+    """
+    grammar_path = os.path.join(ROOT_PATH, 'tree-sitter')
+    candidates = languages or SUPPORTED_LANGUAGES
+    missing = [language for language in candidates if not os.path.exists(get_grammar_path(language))]
+    if any(grammar.get_grammar_source(language, grammar_path) for language in missing):
+        grammar.build_bundle(grammar_path)
+        missing = [language for language in missing if not os.path.exists(get_grammar_path(language))]
+    
+    if missing and languages is not None:
+        raise FileNotFoundError(f"Not found the tree-sitter grammar of {', '.join(missing)}, put their "
+                                f"sources in {grammar_path}/tree-sitter-<language> and run "
+                                "`python src/utils/grammar.py`")
+    if missing:
+        logger.warning("Not found the tree-sitter grammar of %s, their records are skipped" % ', '.join(missing))
+    return [language for language in candidates if language not in missing]
+
+
+def get_languages(opt):
+    """
+    Get the list of processing language from `--language`
+
+    Returns:
+        List[str]: normalized languages, None for `auto` (any supported language)
+    """
+    if any(str(language).lower() == 'auto' for language in opt.language):
+        return None
+    languages = list(dict.fromkeys(normalize_language(language) for language in opt.language))
+    for language in languages:
+        if language not in SUPPORTED_LANGUAGES:
+            raise ValueError(f'Language {language} not supported')
+    return languages
+
+
+def is_multi_language(opt) -> bool:
+    """Several languages (or `auto`): records are routed by language and saved per language"""
+    return opt.languages is None or len(opt.languages) > 1
+
+
+def detect_language(metadata, opt):
+    """
+    Get the language of a record. With a single `--language`, every record
+    is processed as that language. Otherwise use the `language` field of the
+    record, then its `ext` field (see the data format .yaml).
+
+    Args:
+        metadata (Dict): record metadata
+        opt: execute arguments
+
+    Returns:
+        str: normalized language, None if not supported or not selected
+    """
+    if not is_multi_language(opt):
+        return opt.languages[0]
+    
+    language = normalize_language(metadata.get('language'))
+    if language not in SUPPORTED_LANGUAGES and metadata.get('ext') is not None:
+        language = EXTENSION_LANGUAGES.get(str(metadata['ext']).lower().lstrip('.'))
     
-    for path in [raw_path, filtered_path, extracted_path]:
-        os.makedirs(path, exist_ok = True)
+    if language not in SUPPORTED_LANGUAGES or (opt.languages and language not in opt.languages):
+        return None
+    if opt.grammar_languages is not None and language not in opt.grammar_languages:
+        return None
+    return language
 
-    list_res = extracting(dataset, job_index, ast_parser, language_parser, idx, opt)
+
+def init_worker(opt, dataset=None, writer_queue=None):
+    """
+    Pool initializer, load the language parser and keep the dataset (and
+    the queue of the writer process) once per worker process
+    """
+    global _DATASET, _WRITER_QUEUE
+    if multiprocessing.get_start_method() != 'fork':
+        # `spawn` workers do not inherit the logger of the main process
+        create_logger(filepath=os.path.join(opt.save_path, 'log', 'log.txt'), rank=0)
+    _DATASET = dataset
+    _WRITER_QUEUE = writer_queue
+    if opt.cons_from_raw:
+        # re-filtering raw samples does not parse
+        return
+    for language in opt.languages or []:
+        get_parser(language)
+
+
+def processing_job(args):
+    """
+    Run `processing` on a job, return the result along with the shard
+    index, the index entries of its outputs, the worker pid, the processing
+    time and the stage profile
+    """
+    idx = args[-1]
+    profiler = StageProfiler()
+    t_start = time.perf_counter()
+    result, outputs = processing(_DATASET, *args, profiler=profiler)
+    return idx, result, outputs, os.getpid(), time.perf_counter() - t_start, profiler
+
+
+def get_docstring_cache(opt):
+    """Docstring cache of the process (--docstring_cache_size), None if disabled"""
+    global _DOCSTRING_CACHE
+    if _DOCSTRING_CACHE is None and opt.docstring_cache_size > 0:
+        _DOCSTRING_CACHE = DocstringCache(opt.docstring_cache_size, opt.docstring_cache_chars)
+    return _DOCSTRING_CACHE
+
+
+def get_index_entry(entry, shard, save_path):
+    """Index entry of an output (see `write_shard_index`), path relative to `save_path`"""
+    return {**entry, 'path': os.path.relpath(entry['path'], save_path), 'shard': shard}
+
+
+def get_levels(opt):
+    """Get the list of extracting level, `all` means function, class and inline"""
+    if opt.level == 'all':
+        return ['function', 'class', 'inline']
+    return [opt.level]
+
+
+def processing(dataset, job_index, opt, idx=1, profiler=None): #language, save_path, idx=None, is_file=None):
+    t_start = time.perf_counter()
+    if profiler is None:
+        profiler = StageProfiler()
+    # language parsers are cached per worker process (see `get_parser`)
+    list_res, outputs = extracting(dataset, job_index, idx, opt, profiler)
     
     t_finish = time.perf_counter()
     
     logger.info("Saved batch %i | Processing took %.3f s\n" % (idx, t_finish - t_start))
     
-    return list_res
+    return list_res, outputs
 
 
-def extracting(dataset, indexs, ast, lang_parser, thread_idx, opt):    
-    raw_set, filtered_set, extracted_set = [], [], [] 
-    # logger.info('====== Start batch {} ======'.format(thread_idx))
+def load_samples(dataset, indexs, opt):
+    """
+    Yield samples of a job
     
-    if opt.cons_from_raw:
-        with open(dataset[indexs[0]], 'r') as file:
-            dataset = list(file)
-        indexs = range(len(dataset))
-            
-    for idx in tqdm(indexs, desc=f'Thread {thread_idx} processing: '):
-        data = dataset[idx]
-        if opt.load_from_file or opt.cons_from_raw:
-            data = json.loads(data)
-        assert os.path.exists(opt.data_format), "Not found data format (.yaml file)"
-        
-        with open(opt.data_format, 'r') as stream:
-            data_format = yaml.safe_load(stream)
-        
-        # Load using format
-        # Main content
-        repo = data[data_format["repo"]]
-        path = data[data_format["path"]]
-        language = data[data_format["language"]]
-        metadata_data = {"repo": repo, "path": path, "language": language}
-        
-        # Additional content
-        for key in data_format.keys():
-            if key not in ['code', 'repo', 'path', 'language']:
-                metadata_data[key] = data[data_format[key]]
-        
-        raw_code = data[data_format["code"]]
-        tree = ast.parse(bytes(raw_code, "utf8"))
+    Args:
+        dataset: HuggingFace dataset, list of raw files, `SharedLineIndex` or
+            None (when `indexs` is a .jsonl or .parquet shard)
+        indexs: list of index, (start, end) line range of `SharedLineIndex`,
+            (file, start, end) .jsonl shard or (file, row group, number of row,
+            byte size) .parquet shard
+        opt: execute arguments
+    """
+    if isinstance(dataset, SharedLineIndex):
+        yield from dataset.read(*indexs)
+    
+    elif opt.load_from_file and is_parquet(opt.data_path):
+        # column projection: only read the columns declared in the data format
+        code_key, data_fields = opt.data_fields
+        columns = list(dict.fromkeys([code_key] + [source_key for _, source_key in data_fields]))
+        yield from read_parquet_shard(*indexs, columns=columns)
+    
+    elif opt.load_from_file:
+        yield from read_jsonl_shard(*indexs)
+    
+    elif opt.cons_from_raw:
+        yield from read_jsonl_file(dataset[indexs[0]])
+    
+    else:
+        for idx in indexs:
+            yield dataset[idx]
 
-        # try:
-        # Extract function
-        if opt.cons_from_raw:
-            raw_fn = [data]
 
-        if opt.level == 'function':
-            raw_fn = list(process_raw_node(tree, raw_code, lang_parser, metadata_data))
-            raw_set.extend(raw_fn)
-            if opt.raw_only:
-                continue
-            filtered_fn_list = list(get_node_definitions(raw_fn))
-            if str(language).lower() == 'go':
-                extracted_function_list = filtered_fn_list
-            else:
-                extracted_function_list = list(extract_node(filtered_fn_list, language))
-            
+def has_raw_nodes(level, language) -> bool:
+    """Whether `process_raw_node` runs for a level (no class in Go and C)"""
+    if level == 'class':
+        return not str(language).lower() in ['go', 'c']
+    return level == 'function'
+
+
+def get_raw_nodes(level, tree, raw_code, lang_parser, metadata_data, profiler):
+    """Raw function or class nodes of a parsed file (`raw_code` as str or utf-8 bytes)"""
+    with profiler.stage(f'{level}/process_raw_node'):
+        return list(process_raw_node(tree, raw_code, lang_parser, metadata_data, is_class=(level == 'class')))
+
+
+def extract_level(level, tree, raw_code, lang_parser, metadata_data, writers, opt, profiler, raw_nodes=None):
+    """
+    Extract function, class or inline samples from a parsed file
+
+    Args:
+        level (str): function, class or inline
+        tree (tree_sitter.Tree): parsed source code (None if `raw_nodes` is given)
+        raw_code (str): source code
+        lang_parser (LanguageParser): codetext language parser
+        metadata_data (Dict): file metadata
+        writers (List[JsonlWriter]): raw (None to skip), filtered and extracted writers
+        opt: execute arguments
+        profiler (StageProfiler): stages are timed as `<level>/<stage>`
+        raw_nodes (List[Dict]): function or class nodes if already known
+            (e.g. from the cache), `process_raw_node` is skipped
+    """
+    raw_set, filtered_set, extracted_set = writers
+    language = metadata_data['language']
+    docstring_cache = get_docstring_cache(opt)
+    
+    if level == 'function':
+        raw_fn = raw_nodes
+        if raw_fn is None:
+            raw_fn = get_raw_nodes(level, tree, raw_code, lang_parser, metadata_data, profiler)
+        if opt.raw_only:
+            with profiler.stage('function/write'):
+                if raw_set is not None:
+                    raw_set.extend(raw_fn)
+            return
+        # `get_node_definitions` adds the `docstring` to the raw nodes, write them after it
+        with profiler.stage('function/get_node_definitions'):
+            filtered_fn_list = list(get_node_definitions(raw_fn, docstring_cache))
+        if str(language).lower() == 'go':
+            extracted_function_list = filtered_fn_list
+        else:
+            with profiler.stage('function/extract_node'):
+                extracted_function_list = list(extract_node(filtered_fn_list, language, docstring_cache))
+        
+        with profiler.stage('function/write'):
+            if raw_set is not None:
+                raw_set.extend(raw_fn)
             filtered_set.extend(filtered_fn_list)
             extracted_set.extend(extracted_function_list)
 
-        elif opt.level == 'class':
-            if not str(language).lower() in ['go', 'c']:
-                raw_class = list(process_raw_node(tree, raw_code, lang_parser, metadata_data, is_class=True))
-                filtered_class_list = list(get_node_definitions(raw_class, raw_code))
-                extracted_class_list = list(extract_node(filtered_class_list, language))
-            
-                raw_set.extend(raw_class)    
+    elif level == 'class':
+        if has_raw_nodes(level, language):
+            raw_class = raw_nodes
+            if raw_class is None:
+                raw_class = get_raw_nodes(level, tree, raw_code, lang_parser, metadata_data, profiler)
+            with profiler.stage('class/get_node_definitions'):
+                filtered_class_list = list(get_node_definitions(raw_class, docstring_cache))
+            with profiler.stage('class/extract_node'):
+                extracted_class_list = list(extract_node(filtered_class_list, language, docstring_cache))
+        
+            with profiler.stage('class/write'):
+                if raw_set is not None:
+                    raw_set.extend(raw_class)
                 filtered_set.extend(filtered_class_list)
                 extracted_set.extend(extracted_class_list)
-        
-        elif opt.level == 'inline':
-            raw_line = list(get_line_definitions(tree, raw_code, lang_parser, metadata_data))
+    
+    elif level == 'inline':
+        # `get_line_definitions` updates the metadata in-place
+        with profiler.stage('inline/get_line_definitions'):
+            raw_line = list(get_line_definitions(tree, raw_code, lang_parser, metadata_data.copy()))
+        with profiler.stage('inline/write'):
             extracted_set.extend(raw_line)
+
+
+def get_writers(opt, thread_idx, language=None):
+    """
+    Create raw, filtered and extracted writers of each level, under
+    `<save_path>/<language>/` when `language` is given. There is no raw
+    writer (None) when re-filtering raw samples (`--cons_from_raw`). Outputs
+    are rotated at --max_shard_records / --max_shard_bytes
+
+    Returns:
+        Dict[str, List]: {level: [raw, filtered, extracted]}
+    """
+    save_path = opt.save_path if language is None else os.path.join(opt.save_path, language)
+    writers = {}
+    for level in get_levels(opt):
+        writers[level] = [None] if opt.cons_from_raw else []
+        for set_name in (['filtered', 'extracted'] if opt.cons_from_raw else ['raw', 'filtered', 'extracted']):
+            set_path = os.path.join(save_path, level, set_name)
+            os.makedirs(set_path, exist_ok=True)
+            output_path = os.path.join(set_path, f'batch_{thread_idx}_{level}')
+            kwargs = {'flush_records': opt.flush_records, 'flush_bytes': opt.flush_bytes, 'compression': opt.compression}
+            if _WRITER_QUEUE is not None:
+                open_writer = partial(QueueWriter, _WRITER_QUEUE, level=level, output_format=opt.output_format,
+                                      shard=thread_idx, **kwargs)
+            else:
+                open_writer = partial(get_writer, level=level, output_format=opt.output_format, **kwargs)
+            writers[level].append(RotatingWriter(open_writer, output_path, opt.max_shard_records, opt.max_shard_bytes))
+    return writers
+
+
+def get_quarantine_writer(opt, thread_idx):
+    """Writer of the files skipped by a per-file limit (`<save_path>/quarantine/`)"""
+    quarantine_path = os.path.join(opt.save_path, 'quarantine')
+    os.makedirs(quarantine_path, exist_ok=True)
+    return get_writer(os.path.join(quarantine_path, f'batch_{thread_idx}_{opt.level}'), None, output_format='jsonl')
+
+
+def extracting(dataset, indexs, thread_idx, opt, profiler):    
+    # logger.info('====== Start batch {} ======'.format(thread_idx))
+    levels = get_levels(opt)
+    multi_language = is_multi_language(opt)
+    # {language: {level: writers}}, one output per language when routing
+    # records by language (created on the first record of the language)
+    writers = {} if multi_language else {None: get_writers(opt, thread_idx)}
+    # files over a per-file limit (--max_bytes, --parse_timeout, --max_depth)
+    quarantine = None
+    # raw nodes cache (--cache_path), shared by the workers
+    cache = ExtractionCache(opt.cache_path) if opt.cache_path else None
+    n_skip = 0
+    n_raw = {}
+    code_key, data_fields = opt.data_fields
+    
+    samples = profiler.iterate('read', load_samples(dataset, indexs, opt))
+    for data in tqdm(samples, desc=f'Thread {thread_idx} processing: '):
+        if opt.cons_from_raw:
+            # raw sample: filter and extract it as is, no parsing
+            language = detect_language(data, opt)
+        else:
+            # Load using format
+            metadata_data = {key: data[source_key] for key, source_key in data_fields}
+            language = detect_language(metadata_data, opt)
+        
+        if language is None:
+            n_skip += 1
+            profiler.end_file()
+            continue
+        output = language if multi_language else None
+        if output not in writers:
+            writers[output] = get_writers(opt, thread_idx, output)
+        
+        if opt.cons_from_raw:
+            extract_level(opt.level, None, None, None, data, writers[output][opt.level], opt, profiler, [data])
+            n_raw[output] = n_raw.get(output, 0) + 1
+            profiler.end_file()
+            continue
+        
+        ast, lang_parser = get_parser(language)
+        raw_code = data[code_key]
+        code_bytes = bytes(raw_code, "utf8")
+        
+        cached = {}
+        raw_levels = [level for level in levels if has_raw_nodes(level, metadata_data['language'])]
+        if cache is not None and raw_levels:
+            hexsha = metadata_data.get('hexsha') or get_blob_hexsha(code_bytes)
+            version = get_parser_version(get_grammar_path(language))
+            with profiler.stage('cache'):
+                for level in raw_levels:
+                    raw_nodes = cache.get(hexsha, language, level, version, metadata_data)
+                    if raw_nodes is not None:
+                        cached[level] = raw_nodes
+            profiler.count('cache/hit', len(cached))
+            profiler.count('cache/miss', len(raw_levels) - len(cached))
+        
+        # parse once (unless no level needs the tree: cached raw nodes or no
+        # class level in the language), then extract every level from the
+        # same tree. Parsing and raw nodes are bounded by --parse_timeout
+        tree, reason = None, None
+        raw_nodes = dict(cached)
+        needs_tree = any(level == 'inline' or (level in raw_levels and level not in cached) for level in levels)
+        try:
+            with time_limit(opt.parse_timeout):
+                if needs_tree:
+                    with profiler.stage('parse'):
+                        tree, reason = parse_with_limits(ast, code_bytes, opt.max_bytes,
+                                                         opt.parse_timeout, opt.max_depth)
+                if reason is None:
+                    for level in raw_levels:
+                        if level not in raw_nodes:
+                            # slice node texts from the bytes given to the parser
+                            raw_nodes[level] = get_raw_nodes(level, tree, code_bytes, lang_parser,
+                                                             metadata_data, profiler)
+        except FileTimeout:
+            tree, reason = None, 'parse_timeout'
+        if reason is not None:
+            if quarantine is None:
+                quarantine = get_quarantine_writer(opt, thread_idx)
+            quarantine.write({'repo': metadata_data['repo'], 'path': metadata_data['path'],
+                              'language': metadata_data['language'], 'hexsha': metadata_data.get('hexsha'),
+                              'reason': reason, 'bytes': len(code_bytes)})
+            logger.warning("Quarantine %s (%s)" % (metadata_data['path'], reason))
+            profiler.count(f'quarantine/{reason}')
+            profiler.end_file(len(code_bytes))
+            continue
+
+        for level in levels:
+            if cache is not None and level in raw_levels and level not in cached:
+                with profiler.stage('cache'):
+                    cache.put(hexsha, language, level, version, raw_nodes[level], metadata_data)
+            extract_level(level, tree, raw_code, lang_parser, metadata_data, writers[output][level], opt, profiler,
+                          raw_nodes.get(level))
+        profiler.end_file(len(code_bytes))
         
     # Saving
-    save_path = os.path.join(opt.save_path, opt.level)
-    raw_path = os.path.join(save_path, 'raw')
-    filtered_path = os.path.join(save_path, 'filtered')
-    extracted_path = os.path.join(save_path, 'extracted')
-    
-    write_jsonl(raw_set, os.path.join(raw_path, f'batch_{thread_idx}_{opt.level}.jsonl'))
-    write_jsonl(filtered_set, os.path.join(filtered_path, f'batch_{thread_idx}_{opt.level}.jsonl'))
-    write_jsonl(extracted_set, os.path.join(extracted_path, f'batch_{thread_idx}_{opt.level}.jsonl'))
-    
-    res = [len(raw_set), len(filtered_set), len(extracted_set)]
-    msg = '====== End of batch {} ====== \n'.format(thread_idx) + \
-        'Level {}: Total Raw {} | Filterable {} | Extractable {}'.format(opt.level, *res)
+    res = {}
+    outputs = []
+    msg = '====== End of batch {} ======'.format(thread_idx)
+    for output, output_writers in writers.items():
+        for level in levels:
+            with profiler.stage(f'{level}/write', per_file=False):
+                for writer in output_writers[level]:
+                    if writer is not None:
+                        outputs.extend(writer.close())
+            key = level if output is None else f'{output}/{level}'
+            res[key] = [writer.n_record if writer is not None else n_raw.get(output, 0)
+                        for writer in output_writers[level]]
+            msg += '\nLevel {}: Total Raw {} | Filterable {} | Extractable {}'.format(key, *res[key])
+    if n_skip:
+        msg += '\nSkipped {} samples (language not supported or not selected)'.format(n_skip)
+    if cache is not None:
+        with profiler.stage('cache', per_file=False):
+            cache.close()
+    docstring_cache = get_docstring_cache(opt)
+    if docstring_cache is not None:
+        for name, n in docstring_cache.pop_counts().items():
+            profiler.count(f'docstring_cache/{name}', n)
+    if quarantine is not None:
+        quarantine.close()
+        msg += '\nQuarantined {} samples'.format(quarantine.n_record)
+    if _WRITER_QUEUE is not None:
+        # every output of the shard is queued, the writer process reports it once closed
+        _WRITER_QUEUE.put(('done', thread_idx, None, None))
     
     logger.info(msg)
-    return res
+    return res, outputs
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'data_path', 
-        help='data folder contain file.jsonl or huggingface dataset cache'
+        help='data folder contain file.jsonl, .parquet files or huggingface dataset cache'
     )
     parser.add_argument(
         '--save_path', 
@@ -253,13 +758,17 @@ if __name__ == '__main__':
         '--level', 
         type=str, 
         default='function',
-        help='Extract function/class/inline level or all'
+        choices=['function', 'class', 'inline', 'all'],
+        help='Extract function/class/inline level or all (parse each file once for all levels)'
     )
     parser.add_argument(
         '--language', 
         type=str, 
-        default='Python',
-        help='Declare processing language (e.g: Python, Java)'
+        nargs='+',
+        default=['Python'],
+        help='Declare processing language(s) (e.g: Python Java), several languages or `auto` '
+             '(detect from the `language`/`ext` field) route each sample to its own parser '
+             'and save the outputs under <save_path>/<language>/'
     )
     parser.add_argument(
         '--data_format', 
@@ -270,7 +779,7 @@ if __name__ == '__main__':
     parser.add_argument(
         '--load_from_file', 
         action='store_true',
-        help='Load from .json or .jsonl'
+        help='Load from .json, .jsonl or .parquet (file or folder of .parquet files)'
     )
     parser.add_argument(
         '--n_sample', 
@@ -281,7 +790,8 @@ if __name__ == '__main__':
     parser.add_argument(
         '--cons_from_raw', 
         action='store_true',
-        help='Continues from raw .jsonl (pass folder path to data)'
+        help='Re-filter raw function/class samples without parsing (pass the `<level>/raw` folder '
+             'of a previous run as data path, with the same --level)'
     )
     parser.add_argument(
         '--raw_only', 
@@ -299,12 +809,110 @@ if __name__ == '__main__':
         help=''
     )
     
+    # Per-file limits, files over a limit are skipped and logged to <save_path>/quarantine/
+    parser.add_argument(
+        '--max_bytes',
+        type=int,
+        default=None,
+        help='Skip files larger than N bytes'
+    )
+    parser.add_argument(
+        '--parse_timeout',
+        type=float,
+        default=None,
+        help='Skip files taking more than N seconds (wall-clock) to parse and extract their '
+             'function/class nodes. Without the parse timeout API of newer tree-sitter releases, '
+             'a long parse is only stopped once it returns'
+    )
+    parser.add_argument(
+        '--max_depth',
+        type=int,
+        default=None,
+        help='Skip files whose syntax tree is deeper than N'
+    )
+    
+    parser.add_argument(
+        '--cache_path',
+        type=str,
+        default=None,
+        help='SQLite cache of the raw function/class nodes keyed by blob hexsha, language and '
+             'parser version, re-runs skip parsing of cached files (entries are invalidated '
+             'when the grammar or the extraction code changes)'
+    )
+    parser.add_argument(
+        '--docstring_cache_size',
+        type=int,
+        default=10000,
+        help='Memoize the cleaning and parsing of the last N distinct docstrings in each worker '
+             '(duplicate license headers, boilerplate docs), 0 to disable'
+    )
+    parser.add_argument(
+        '--docstring_cache_chars',
+        type=int,
+        default=8 * 1024 * 1024,
+        help='Maximum total size (in characters) of the docstrings held by the docstring cache'
+    )
+    
+    # Output settings
+    parser.add_argument(
+        '--output_format',
+        type=str,
+        default='jsonl',
+        choices=['jsonl', 'parquet'],
+        help='Save samples as .jsonl or columnar .parquet (fixed schema, see data/README.md)'
+    )
+    parser.add_argument(
+        '--compression',
+        type=str,
+        default=None,
+        choices=['none', 'gzip', 'zstd'],
+        help='Compress output .jsonl on the fly (or .parquet codec, default to snappy)'
+    )
+    parser.add_argument(
+        '--async_writer',
+        action='store_true',
+        help='Write outputs in a dedicated process, workers push serialized batches into a bounded queue'
+    )
+    parser.add_argument(
+        '--writer_queue_size',
+        type=int,
+        default=64,
+        help='Maximum number of batches waiting for the writer process (--async_writer), '
+             'workers block when the queue is full'
+    )
+    parser.add_argument(
+        '--max_shard_records',
+        type=int,
+        default=None,
+        help='Rotate output files after N records (<level>/<set>/batch_<shard>_<level>_<part>), '
+             'every level folder gets an index.json of its files'
+    )
+    parser.add_argument(
+        '--max_shard_bytes',
+        type=int,
+        default=None,
+        help='Rotate output files after about M bytes (uncompressed .jsonl lines, code length for .parquet)'
+    )
+    parser.add_argument(
+        '--flush_records',
+        type=int,
+        default=1000,
+        help='Flush output to disk every N records'
+    )
+    parser.add_argument(
+        '--flush_bytes',
+        type=int,
+        default=16*1024*1024,
+        help='Flush output to disk every M bytes'
+    )
+    
     # Processing on multiple CPUs
     parser.add_argument(
         '--n_split', 
         type=int, 
         default=40,
-        help='Split all the raw data into N file and feed into process pool'
+        help='Split all the raw data into N file and feed into process pool '
+             '(parsers are cached per worker, so N can be much larger than the number of core)'
     )
     parser.add_argument(
         '--n_core',
@@ -312,6 +920,24 @@ if __name__ == '__main__':
         default=1,
         help='Number of maximum process to create'
     )
+    parser.add_argument(
+        '--shared_memory',
+        action='store_true',
+        help='Index .jsonl lines in shared memory and memory-map the file in '
+             'workers, jobs only carry a (start, end) line range'
+    )
+    parser.add_argument(
+        '--start_method',
+        type=str,
+        default='fork',
+        choices=['fork', 'spawn', 'forkserver'],
+        help='Multiprocessing start method'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip the shards completed by the previous run (see manifest_<level>.jsonl)'
+    )
     parser.add_argument(
         '--debug',
         action='store_true'
@@ -326,7 +952,6 @@ if __name__ == '__main__':
         os.mkdir(log_path)
     
     create_logger(filepath=os.path.join(log_path, 'log.txt'), rank=0)
-    logger = logging.getLogger()
     logger.info(f'Execute Arguments: {opt}')
-    multiprocessing.set_start_method("fork")
+    multiprocessing.set_start_method(opt.start_method)
     main(opt)
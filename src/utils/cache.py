@@ -0,0 +1,207 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import importlib.metadata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+from .io import dumps_bytes, loads
+
+
+# Bump when the stored format changes, entries of older versions are then
+# ignored (changes of the extraction code are covered by `RAW_NODE_SOURCES`)
+CACHE_VERSION = 2
+
+# Sources producing the raw nodes (`process_raw_node`, `check_function`
+# rules, code line count), relative to `src/utils`
+RAW_NODE_SOURCES = ['utils.py', 'spans.py', os.path.join('noise_removal', 'noise_removal.py')]
+
+# Fields `process_raw_node` sets after the file metadata: never taken from
+# the sample, even when the data format has a field of the same name
+NODE_FIELDS = ('code', 'code_tokens', 'original_docstring', 'comment', 'docstring_tokens')
+
+
+def get_blob_hexsha(code: bytes) -> str:
+    """Git blob hash of a file (same as the `hexsha` field of The Stack)"""
+    return hashlib.sha1(b'blob %d\0' % len(code) + code).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _hash_file(filepath: str) -> str:
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_parser_version(grammar_path: str) -> str:
+    """
+    Version of everything producing the raw nodes: cache version, `codetext`,
+    `tree-sitter`, the content of the grammar .so file and of the extraction
+    sources (`RAW_NODE_SOURCES`)
+    """
+    versions = [str(CACHE_VERSION)]
+    for package in ['codetext', 'tree-sitter']:
+        try:
+            versions.append(importlib.metadata.version(package))
+        except importlib.metadata.PackageNotFoundError:
+            versions.append('unknown')
+    versions.append(_hash_file(os.path.realpath(grammar_path)))
+    source_path = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for source in RAW_NODE_SOURCES:
+        digest.update(_hash_file(os.path.join(source_path, source)).encode())
+    versions.append(digest.hexdigest())
+    return '-'.join(versions)
+
+
+class ExtractionCache:
+    """
+    On-disk (SQLite) cache of the raw nodes of a file (`process_raw_node`
+    output), keyed by blob hexsha, language, level and parser version, so a
+    re-run skips parsing (a change of the extraction rules changes the
+    parser version, see `get_parser_version`). Metadata fields are not stored,
+    they are filled from the current sample on `get` (except `NODE_FIELDS`,
+    which are always the stored node values). Entries are buffered
+    and written in one transaction every `flush_records` entries, several
+    processes can share the same file.
+
+    Args:
+        filepath (str): path to the .sqlite file
+        flush_records (int): write after N buffered entries
+    """
+    def __init__(self, filepath: str, flush_records: int=1000):
+        self.filepath = filepath
+        self.flush_records = flush_records
+        self.buffer = []
+
+        self.connection = sqlite3.connect(filepath, timeout=600)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS raw_nodes ('
+            'hexsha TEXT, language TEXT, level TEXT, version TEXT, records BLOB, '
+            'PRIMARY KEY (hexsha, language, level, version)) WITHOUT ROWID'
+        )
+        self.connection.commit()
+
+    def get(self, hexsha: str, language: str, level: str, version: str,
+            metadata: Dict) -> Optional[List[Dict]]:
+        """
+        Get the cached raw nodes of a file, None if not cached
+
+        Args:
+            hexsha (str): blob hexsha
+            language (str): normalized language
+            level (str): function or class
+            version (str): parser version (see `get_parser_version`)
+            metadata (Dict): metadata of the current sample
+        """
+        row = self.connection.execute(
+            'SELECT records FROM raw_nodes WHERE hexsha=? AND language=? AND level=? AND version=?',
+            (hexsha, language, level, version)
+        ).fetchone()
+        if row is None:
+            return None
+
+        item = loads(zlib.decompress(row[0]))
+        metadata_keys = set(item['metadata_keys'])
+        records = []
+        for cached_record in item['records']:
+            # same key order as `process_raw_node`
+            record = {}
+            for key, value in cached_record.items():
+                if key not in metadata_keys:
+                    record[key] = value
+                elif key in metadata:
+                    record[key] = metadata[key]
+            for key, value in metadata.items():
+                if key not in record:
+                    record[key] = value
+            records.append(record)
+        return records
+
+    def put(self, hexsha: str, language: str, level: str, version: str,
+            records: List[Dict], metadata: Dict):
+        """Cache the raw nodes of a file (see `get`)"""
+        metadata_keys = [key for key in metadata if key not in NODE_FIELDS]
+        item = {
+            'metadata_keys': metadata_keys,
+            'records': [{key: None if key in metadata_keys else value for key, value in record.items()}
+                        for record in records],
+        }
+        self.buffer.append((hexsha, language, level, version, zlib.compress(dumps_bytes(item), 1)))
+        if len(self.buffer) >= self.flush_records:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO raw_nodes VALUES (?, ?, ?, ?, ?)', self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+class DocstringCache:
+    """
+    In-memory LRU cache of the docstring processing (`clean_docstring`,
+    `extract_docstring`), so duplicate docstrings (license headers,
+    boilerplate Javadoc, vendored copies) are processed once per process.
+    Entries are keyed by a hash of the inputs and bounded by count and by
+    the total size of their inputs (in characters). Cached values are shared,
+    callers must not modify them. Hits, misses, evictions and the time spent
+    computing the misses are tallied for the profiler (see `pop_counts`), the
+    time saved by the hits is estimated from the mean miss time.
+
+    Args:
+        max_entries (int): maximum number of entries
+        max_chars (int): maximum total size of the inputs of the entries
+    """
+    def __init__(self, max_entries: int=10000, max_chars: int=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.entries = OrderedDict()  # key hash -> (size, value)
+        self.n_char = 0
+        self.counts = {'hit': 0, 'miss': 0, 'evict': 0, 'miss_s': 0.}
+
+    def get(self, key: tuple, compute: Callable[[], Any]) -> Any:
+        """
+        Value of `key` (tuple of the inputs, e.g. (docstring, language,
+        parameters)), computed with `compute()` and cached on a miss
+        """
+        text = repr(key)
+        digest = hashlib.blake2b(text.encode('utf8', 'surrogatepass'), digest_size=16).digest()
+        entry = self.entries.get(digest)
+        if entry is not None:
+            self.entries.move_to_end(digest)
+            self.counts['hit'] += 1
+            return entry[1]
+
+        self.counts['miss'] += 1
+        start = time.perf_counter()
+        value = compute()
+        self.counts['miss_s'] += time.perf_counter() - start
+        size = len(text)
+        if size <= self.max_chars:
+            self.entries[digest] = (size, value)
+            self.n_char += size
+            while len(self.entries) > self.max_entries or self.n_char > self.max_chars:
+                _, (old_size, _) = self.entries.popitem(last=False)
+                self.n_char -= old_size
+                self.counts['evict'] += 1
+        return value
+
+    def pop_counts(self) -> Dict[str, float]:
+        """Hits, misses, evictions and time spent on misses (`miss_s`) since the last call"""
+        counts = self.counts
+        self.counts = {'hit': 0, 'miss': 0, 'evict': 0, 'miss_s': 0.}
+        return counts
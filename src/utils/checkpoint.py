@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+import logging
+
+
+logger = logging.getLogger('utils')
+
+
+def get_signature(*items) -> str:
+    """
+    Get a stable hash of the run settings (e.g. level, input, shard list),
+    used to make sure a resumed run splits the data the same way
+    """
+    content = json.dumps([str(item) for item in items])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class Manifest:
+    """
+    Record of completed shards, one json line per shard with its result and
+    the index entries of its outputs (see `write_shard_index`). The first
+    line holds the run signature. A shard is only recorded after all of its
+    output files are renamed to their final name.
+
+    Args:
+        filepath (str): manifest path
+        signature (str): run signature (see `get_signature`)
+        resume (bool): load completed shards instead of starting over
+    """
+    def __init__(self, filepath: str, signature: str, resume: bool=False):
+        self.filepath = filepath
+        self.signature = signature
+        self.completed = {}
+        self.outputs = {}
+
+        if resume and os.path.exists(filepath):
+            lines = self._load()
+            if lines and lines[0].get('signature') != signature:
+                raise ValueError(f"Can not resume from {filepath}, data or settings (e.g. --n_split, "
+                                 "--level, --output_format) changed since the last run")
+            for line in lines[1:]:
+                self.completed[line['shard']] = line['result']
+                self.outputs[line['shard']] = line.get('outputs', [])
+            logger.info(f"Resume from {filepath}, skip {len(self.completed)} completed shards")
+            self.file = open(filepath, 'a')
+            if not lines:
+                self._write({'signature': signature})
+        else:
+            self.file = open(filepath, 'w')
+            self._write({'signature': signature})
+
+    def _load(self):
+        """
+        Read the recorded lines. A last line cut by a killed run (no newline
+        or not decodable) is dropped and the file is truncated back to the
+        last complete line, so the following records are appended after it
+        """
+        lines, offset = [], 0
+        with open(self.filepath, 'rb') as file:
+            raw_lines = list(file)
+        for idx, raw_line in enumerate(raw_lines):
+            complete = raw_line.endswith(b'\n')
+            if complete and raw_line.strip():
+                try:
+                    lines.append(json.loads(raw_line))
+                except ValueError:
+                    complete = False
+            if not complete:
+                if idx < len(raw_lines) - 1:
+                    raise ValueError(f"Can not resume from {self.filepath}, line {idx + 1} is corrupted")
+                logger.warning(f"Drop the incomplete last line of {self.filepath}")
+                break
+            offset += len(raw_line)
+        
+        if offset < sum(len(raw_line) for raw_line in raw_lines):
+            with open(self.filepath, 'r+b') as file:
+                file.truncate(offset)
+        return lines
+
+    def _write(self, item):
+        self.file.write(json.dumps(item) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def is_completed(self, shard: int) -> bool:
+        return shard in self.completed
+
+    def add(self, shard: int, result, outputs=None):
+        self.completed[shard] = result
+        self.outputs[shard] = outputs or []
+        self._write({'shard': shard, 'result': result, 'outputs': self.outputs[shard]})
+
+    def close(self):
+        self.file.close()
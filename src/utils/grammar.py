@@ -0,0 +1,168 @@
+"""
+Offline build of the tree-sitter grammars into one shared library
+
+    python src/utils/grammar.py --grammar_path ./tree-sitter
+
+Compile every grammar found under `<grammar_path>/tree-sitter-<language>/`
+(vendored sources, e.g. `git clone https://github.com/tree-sitter/tree-sitter-python`
+done once beforehand) into `<grammar_path>/languages.so`, along with a
+`languages.json` version stamp. The build holds `languages.lock`, so
+concurrent builds do not race, and is skipped when the stamp is up to date.
+Workers only load the ready library.
+"""
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import argparse
+import importlib.metadata
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from tree_sitter import Language
+
+
+logger = logging.getLogger('utils')
+
+BUNDLE_NAME = 'languages'
+
+# language -> folder of the vendored grammar source
+GRAMMAR_SOURCES = {
+    'python': 'tree-sitter-python',
+    'java': 'tree-sitter-java',
+    'javascript': 'tree-sitter-javascript',
+    'go': 'tree-sitter-go',
+    'ruby': 'tree-sitter-ruby',
+    'rust': 'tree-sitter-rust',
+    'php': 'tree-sitter-php',
+    'c': 'tree-sitter-c',
+    'cpp': 'tree-sitter-cpp',
+    'c_sharp': 'tree-sitter-c-sharp',
+}
+
+
+def get_grammar_source(language: str, grammar_path: str) -> Optional[str]:
+    """
+    Folder of the vendored source of a grammar (the one holding
+    `src/parser.c`), None if not found
+    """
+    source_path = os.path.join(grammar_path, GRAMMAR_SOURCES[language])
+    # e.g. tree-sitter-php holds `php/` and `php_only/` grammars
+    for path in [source_path, os.path.join(source_path, language)]:
+        if os.path.exists(os.path.join(path, 'src', 'parser.c')):
+            return path
+    return None
+
+
+def get_source_version(source_path: str) -> str:
+    """Hash of the C/C++ sources and headers of a grammar (parser and external scanner)"""
+    digest = hashlib.sha1()
+    src_path = os.path.join(source_path, 'src')
+    for root, _, filenames in sorted(os.walk(src_path)):
+        for filename in sorted(filenames):
+            if filename.endswith(('.c', '.cc', '.h')):
+                filepath = os.path.join(root, filename)
+                with open(filepath, 'rb') as file:
+                    digest.update(os.path.relpath(filepath, src_path).encode() + b'\0' + file.read())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def read_stamp(grammar_path: str) -> Optional[Dict]:
+    """Version stamp of the bundle, None if it is not built"""
+    stamp_path = os.path.join(grammar_path, f'{BUNDLE_NAME}.json')
+    if not os.path.exists(stamp_path) or not os.path.exists(os.path.join(grammar_path, f'{BUNDLE_NAME}.so')):
+        return None
+    with open(stamp_path, 'r') as file:
+        return json.load(file)
+
+
+def get_grammar_path(language: str, grammar_path: str) -> str:
+    """
+    Path to the shared library of a (normalized) language: the bundle if it
+    holds the language, otherwise `<grammar_path>/<language>.so`
+    """
+    stamp = read_stamp(grammar_path)
+    if stamp is not None and language in stamp['languages']:
+        return os.path.join(grammar_path, f'{BUNDLE_NAME}.so')
+    return os.path.join(grammar_path, f'{language}.so')
+
+
+def build_bundle(grammar_path: str, languages: List[str]=None, force: bool=False) -> Dict:
+    """
+    Compile the vendored grammars into `<grammar_path>/languages.so` and
+    write its version stamp, unless the stamp already matches
+
+    Args:
+        grammar_path (str): tree-sitter folder
+        languages (List[str]): languages to build, default to every language
+            with a vendored source
+        force (bool): rebuild even if the stamp is up to date
+
+    Returns:
+        Dict: version stamp (tree-sitter version, languages and their source hash)
+    """
+    sources = {}
+    for language in languages or GRAMMAR_SOURCES:
+        source_path = get_grammar_source(language, grammar_path)
+        if source_path is not None:
+            sources[language] = source_path
+        elif languages:
+            raise FileNotFoundError(f"Not found the source of the {language} grammar in "
+                                    f"{os.path.join(grammar_path, GRAMMAR_SOURCES[language])}")
+    if not sources:
+        raise FileNotFoundError(f"Not found any grammar source in {grammar_path}")
+
+    stamp = {
+        'tree_sitter': importlib.metadata.version('tree-sitter'),
+        'languages': {language: get_source_version(path) for language, path in sources.items()},
+    }
+    bundle_path = os.path.join(grammar_path, f'{BUNDLE_NAME}.so')
+    with open(os.path.join(grammar_path, f'{BUNDLE_NAME}.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        read_stamp.cache_clear()
+        if not force and read_stamp(grammar_path) == stamp:
+            logger.info(f"{bundle_path} is up to date")
+            return stamp
+
+        logger.info(f"Build {', '.join(sources)} into {bundle_path}")
+        tmp_path = os.path.join(grammar_path, f'{BUNDLE_NAME}.tmp.so')
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        Language.build_library(tmp_path, list(sources.values()))
+        os.replace(tmp_path, bundle_path)
+
+        stamp_path = os.path.join(grammar_path, f'{BUNDLE_NAME}.json')
+        with open(stamp_path + '.tmp', 'w') as file:
+            json.dump(stamp, file, indent=1)
+        os.replace(stamp_path + '.tmp', stamp_path)
+        read_stamp.cache_clear()
+    return stamp
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--grammar_path',
+        type=str,
+        default=os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'tree-sitter'),
+        help='tree-sitter folder holding the vendored tree-sitter-<language> sources'
+    )
+    parser.add_argument(
+        '--language',
+        type=str,
+        nargs='+',
+        default=None,
+        help='Languages to build (default to every vendored grammar)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Rebuild even if the version stamp is up to date'
+    )
+    opt = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    stamp = build_bundle(opt.grammar_path, opt.language, opt.force)
+    print(json.dumps(stamp, indent=1))
@@ -0,0 +1,136 @@
+"""
+JSON codec shared by every stage of the pipeline. Use `orjson` (and
+`msgspec` for partial, typed decoding) when available, fall back to the
+standard `json` module otherwise. The output is plain JSON, files written
+with one backend can be read with the other.
+"""
+import json
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from codetext.utils import module_available
+
+
+_ORJSON_AVAILABLE = module_available("orjson")
+_MSGSPEC_AVAILABLE = module_available("msgspec")
+
+if _ORJSON_AVAILABLE:
+    import orjson
+
+if _MSGSPEC_AVAILABLE:
+    import msgspec
+
+JSONDecodeError = json.JSONDecodeError
+
+# Known record fields and their types (see `data/README.md`), used by the
+# typed decoders. Unknown fields are decoded as `Any`.
+RECORD_FIELDS = {
+    'id': Any,
+    'task_id': Any,
+    'problem_id': Any,
+    'hexsha': Optional[str],
+    'repo': Optional[str],
+    'path': Optional[str],
+    'language': Optional[str],
+    'license': Any,
+    'identifier': Optional[str],
+    'parameters': Any,
+    'return_type': Optional[str],
+    'code': Optional[str],
+    'code_tokens': Optional[List[str]],
+    'original_docstring': Optional[str],
+    'docstring': Optional[str],
+    'docstring_tokens': Optional[List[str]],
+    'short_docstring': Optional[str],
+    'short_docstring_tokens': Optional[List[str]],
+    'comment': Any,
+    'docstring_params': Optional[Dict[str, Any]],
+    'original_comment': Optional[str],
+    'comment_tokens': Optional[List[str]],
+}
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Decode a JSON document (e.g. a line of .jsonl)"""
+    if _ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN written by `json.dump`, let the standard parser decide
+            pass
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """
+    Encode an object to UTF-8 JSON bytes (non-ASCII characters are kept).
+    Strings with lone surrogates (e.g. from scraped code) are written
+    escaped. NaN and Infinity are written as `null` with `orjson` (`json`
+    writes them as the non-standard `NaN` / `Infinity`)
+    """
+    if _ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. integer larger than 64-bit or lone surrogate
+            pass
+    try:
+        return json.dumps(obj, ensure_ascii=False).encode('utf8')
+    except UnicodeEncodeError:
+        # lone surrogates can only be written as \u escapes
+        return json.dumps(obj, ensure_ascii=True).encode('utf8')
+
+
+def dumps(obj: Any) -> str:
+    """Encode an object to a JSON string (non-ASCII characters are kept)"""
+    return dumps_bytes(obj).decode('utf8')
+
+
+def dump_line(obj: Any, file):
+    """Write an object as a line of .jsonl into a text file (opened with `encoding='utf8'`)"""
+    file.write(dumps(obj))
+    file.write('\n')
+
+
+@lru_cache(maxsize=None)
+def _get_decoder(fields: tuple) -> Callable[[Union[str, bytes]], Dict]:
+    if not _MSGSPEC_AVAILABLE:
+        def decode(data):
+            item = loads(data)
+            return {key: item[key] for key in fields if key in item}
+        return decode
+
+    record_type = msgspec.defstruct(
+        'Record',
+        [(key, Union[RECORD_FIELDS.get(key, Any), msgspec.UnsetType], msgspec.UNSET) for key in fields],
+    )
+    decoder = msgspec.json.Decoder(record_type)
+
+    def decode(data):
+        try:
+            record = decoder.decode(data)
+        except (msgspec.DecodeError, msgspec.ValidationError):
+            # e.g. NaN or unexpected type, fall back to the generic decoder
+            item = loads(data)
+            return {key: item[key] for key in fields if key in item}
+        item = {}
+        for key in fields:
+            value = getattr(record, key)
+            if value is not msgspec.UNSET:
+                item[key] = value
+        return item
+    return decode
+
+
+def get_decoder(fields: List[str]) -> Callable[[Union[str, bytes]], Dict]:
+    """
+    Get a decoder that only decodes the given fields of a record, the
+    other fields are skipped without being materialized (with `msgspec`)
+
+    Args:
+        fields (List[str]): fields to decode (e.g. ['license', 'code_tokens'])
+
+    Returns:
+        Callable: decode a JSON line into a dict of the fields present in the record
+    """
+    return _get_decoder(tuple(fields))
@@ -0,0 +1,135 @@
+import signal
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+import tree_sitter
+
+
+logger = logging.getLogger('utils')
+
+_TIMEOUT_WARNED = False
+
+
+class FileTimeout(BaseException):
+    """
+    Raised by `time_limit` when a file runs over its time budget. Not an
+    `Exception`, so the `except Exception` of the extraction code (e.g.
+    `process_raw_node`) does not swallow it
+    """
+
+
+def _raise_timeout(signum, frame):
+    raise FileTimeout()
+
+
+@contextmanager
+def time_limit(timeout: float):
+    """
+    Raise `FileTimeout` in the block once it runs more than `timeout`
+    seconds of wall-clock time (`SIGALRM`). The signal is handled between
+    Python bytecodes: Python code (e.g. the `codetext` traversal) is stopped
+    right away, a call into C (e.g. `Parser.parse` without the tree-sitter
+    timeout API) only when it returns. No limit if `timeout` is 0 or None,
+    or outside the main thread of a Unix process
+    """
+    if not timeout or not hasattr(signal, 'setitimer') \
+            or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def set_parse_timeout(parser: tree_sitter.Parser, timeout: float) -> bool:
+    """
+    Set the tree-sitter parse timeout (`timeout_micros`) of a parser
+
+    Args:
+        parser (tree_sitter.Parser): parser
+        timeout (float): timeout in second, 0 or None to disable
+
+    Returns:
+        bool: False if the installed `tree-sitter` has no timeout API
+    """
+    global _TIMEOUT_WARNED
+    timeout_micros = int(timeout * 1e6) if timeout else 0
+    if hasattr(parser, 'set_timeout_micros'):
+        parser.set_timeout_micros(timeout_micros)
+    elif hasattr(type(parser), 'timeout_micros'):
+        parser.timeout_micros = timeout_micros
+    else:
+        if timeout and not _TIMEOUT_WARNED:
+            logger.warning("The installed `tree-sitter` has no parse timeout API, a parse "
+                           "running over --parse_timeout is only stopped once it returns")
+            _TIMEOUT_WARNED = True
+        return False
+    return True
+
+
+def get_tree_depth(tree: tree_sitter.Tree, max_depth: int=None) -> int:
+    """
+    Get the depth of a tree (iteratively, unlike the recursive traversal of
+    `codetext`), stop as soon as it goes over `max_depth`
+    """
+    cursor = tree.walk()
+    depth = depth_reached = 1
+    while True:
+        if cursor.goto_first_child():
+            depth += 1
+            if depth > depth_reached:
+                depth_reached = depth
+                if max_depth and depth > max_depth:
+                    return depth
+            continue
+        while not cursor.goto_next_sibling():
+            if not cursor.goto_parent():
+                return depth_reached
+            depth -= 1
+
+
+def parse_with_limits(parser: tree_sitter.Parser, code: bytes, max_bytes: int=None,
+                      parse_timeout: float=None, max_depth: int=None) -> Tuple[Optional[tree_sitter.Tree], Optional[str]]:
+    """
+    Parse a file unless it goes over one of the per-file limits
+
+    Args:
+        parser (tree_sitter.Parser): parser
+        code (bytes): source code
+        max_bytes (int): maximum size of the file
+        parse_timeout (float): maximum parsing time in second, only
+            enforced with the tree-sitter timeout API (see `time_limit`
+            for a wall-clock limit)
+        max_depth (int): maximum depth of the syntax tree
+
+    Returns:
+        Tuple[tree_sitter.Tree, str]: the tree and None, or None and the
+            reason (`max_bytes`, `parse_timeout` or `max_depth`)
+    """
+    if max_bytes and len(code) > max_bytes:
+        return None, 'max_bytes'
+
+    # always set, the parser is shared and may hold the timeout of a previous call
+    has_timeout = set_parse_timeout(parser, parse_timeout or 0) and bool(parse_timeout)
+    try:
+        tree = parser.parse(code)
+    except ValueError:
+        # some `tree-sitter` versions raise when the parse is cancelled
+        if not has_timeout:
+            raise
+        tree = None
+    if tree is None:
+        # a cancelled parse is resumed by the next `parse` call unless the parser is reset
+        if hasattr(parser, 'reset'):
+            parser.reset()
+        return None, 'parse_timeout'
+
+    if max_depth and get_tree_depth(tree, max_depth) > max_depth:
+        return None, 'max_depth'
+    return tree, None
@@ -0,0 +1,194 @@
+import json
+import math
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict
+
+
+logger = logging.getLogger('utils')
+
+
+# Per-file latency histogram: bucket `b` holds latencies in
+# (MIN_LATENCY * BASE ** (b - 1), MIN_LATENCY * BASE ** b], i.e. ~10% resolution
+_MIN_LATENCY = 1e-6
+_BUCKET_BASE = 1.1
+
+
+def _get_bucket(elapsed: float) -> int:
+    if elapsed <= _MIN_LATENCY:
+        return 0
+    return int(math.ceil(math.log(elapsed / _MIN_LATENCY, _BUCKET_BASE)))
+
+
+def _get_percentile(histogram: Dict[int, int], q: float) -> float:
+    """Upper bound of the bucket holding the `q` quantile"""
+    total = sum(histogram.values())
+    if total == 0:
+        return 0.
+    count = 0
+    for bucket in sorted(histogram):
+        count += histogram[bucket]
+        if count >= q * total:
+            return _MIN_LATENCY * _BUCKET_BASE ** bucket
+    return _MIN_LATENCY * _BUCKET_BASE ** max(histogram)
+
+
+class StageProfiler:
+    """
+    Accumulate wall time and call count of each pipeline stage (read, parse,
+    process_raw_node, ...) in a worker. The time spent by a file in each stage
+    goes into a log-scale histogram for the p50/p95 latency, so the cost is a
+    few `perf_counter` calls per file and the state stays small whatever the
+    number of files. Events (e.g. quarantined files, cache hits) are tallied
+    with `count`. Profilers of the workers are merged with `merge`.
+    """
+    def __init__(self):
+        self.total_time = {}
+        self.calls = {}
+        self.bytes = {}
+        self.histogram = {}
+        self.counters = {}
+        self.n_file = 0
+        self.n_byte = 0
+        self._current = {}
+
+    @contextmanager
+    def stage(self, name: str, per_file: bool=True):
+        """
+        Time the block as stage `name` of the current file, or only add it
+        to the stage total if `per_file` is False (e.g. flushing outputs at
+        the end of a shard)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, per_file)
+
+    def add(self, name: str, elapsed: float, per_file: bool=True):
+        if per_file:
+            self._current[name] = self._current.get(name, 0.) + elapsed
+        else:
+            self.total_time[name] = self.total_time.get(name, 0.) + elapsed
+
+    def count(self, name: str, n: float=1):
+        """Increase counter `name` (a count, or seconds for `*_s` counters)"""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def iterate(self, name: str, iterable):
+        """Yield from `iterable`, timing each step as stage `name`"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def end_file(self, n_byte: int=0):
+        """Close the current file (of `n_byte` bytes of code)"""
+        for name, elapsed in self._current.items():
+            self.total_time[name] = self.total_time.get(name, 0.) + elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.bytes[name] = self.bytes.get(name, 0) + n_byte
+            histogram = self.histogram.setdefault(name, {})
+            bucket = _get_bucket(elapsed)
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        self._current = {}
+        self.n_file += 1
+        self.n_byte += n_byte
+
+    def merge(self, other: 'StageProfiler'):
+        for name in other.total_time:
+            self.total_time[name] = self.total_time.get(name, 0.) + other.total_time[name]
+        for name in other.calls:
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+            self.bytes[name] = self.bytes.get(name, 0) + other.bytes[name]
+            histogram = self.histogram.setdefault(name, {})
+            for bucket, count in other.histogram[name].items():
+                histogram[bucket] = histogram.get(bucket, 0) + count
+        for name, n in other.counters.items():
+            self.count(name, n)
+        self.n_file += other.n_file
+        self.n_byte += other.n_byte
+
+    def report(self, wall_time: float=None, n_record: int=None) -> Dict:
+        """
+        Build the profiling report
+
+        Args:
+            wall_time (float): wall time of the run (for the overall throughput)
+            n_record (int): number of output records
+
+        Returns:
+            Dict: overall throughput, {stage: calls, total time, share,
+                calls/s (files/s for per-file stages), bytes/s, p50 and p95
+                per-file latency}, counters, the hit rate of each
+                `<name>/hit` and `<name>/miss` pair and, given `<name>/miss_s`,
+                the time saved by the hits (hits x mean miss time)
+        """
+        busy_time = sum(self.total_time.values())
+        stages = {}
+        for name, total in sorted(self.total_time.items(), key=lambda x: -x[1]):
+            calls = self.calls.get(name, 0)
+            histogram = self.histogram.get(name, {})
+            stages[name] = {
+                'calls': calls,
+                'total_s': round(total, 6),
+                'share': round(total / busy_time, 4) if busy_time else 0.,
+                'calls_per_s': round(calls / total, 2) if total else None,
+                'bytes_per_s': round(self.bytes.get(name, 0) / total, 2) if total else None,
+                'p50_ms': round(_get_percentile(histogram, 0.50) * 1e3, 4),
+                'p95_ms': round(_get_percentile(histogram, 0.95) * 1e3, 4),
+            }
+
+        report = {'files': self.n_file, 'bytes': self.n_byte, 'busy_s': round(busy_time, 6)}
+        if n_record is not None:
+            report['records'] = n_record
+        if wall_time:
+            report['wall_s'] = round(wall_time, 6)
+            report['files_per_s'] = round(self.n_file / wall_time, 2)
+            report['bytes_per_s'] = round(self.n_byte / wall_time, 2)
+            if n_record is not None:
+                report['records_per_s'] = round(n_record / wall_time, 2)
+        report['stages'] = stages
+        report['counters'] = {name: round(n, 6) if isinstance(n, float) else n
+                              for name, n in sorted(self.counters.items())}
+        hit_rates, saved_time = {}, {}
+        for name, hits in self.counters.items():
+            if name.endswith('/hit'):
+                prefix = name[:-len('/hit')]
+                misses = self.counters.get(prefix + '/miss', 0)
+                if hits + misses:
+                    hit_rates[prefix] = round(hits / (hits + misses), 4)
+                if misses and prefix + '/miss_s' in self.counters:
+                    saved_time[prefix] = round(hits * self.counters[prefix + '/miss_s'] / misses, 6)
+        report['hit_rates'] = dict(sorted(hit_rates.items()))
+        report['saved_s'] = dict(sorted(saved_time.items()))
+        return report
+
+    def save(self, filepath: str, wall_time: float=None, n_record: int=None) -> Dict:
+        """Write the report to a .json file and log a summary"""
+        report = self.report(wall_time, n_record)
+        with open(filepath, 'w') as file:
+            json.dump(report, file, indent=4)
+
+        msg = '====== Stage profile ({} files, saved to {}) ======'.format(self.n_file, filepath)
+        for name, stage in report['stages'].items():
+            msg += '\n{:<32} {:>9.3f} s {:>6.1%} | {:>10.1f} calls/s | p50 {:.3f} ms | p95 {:.3f} ms'.format(
+                name, stage['total_s'], stage['share'], stage['calls_per_s'] or 0.,
+                stage['p50_ms'], stage['p95_ms'])
+        for name, n in report['counters'].items():
+            msg += '\n{:<32} {:>9}'.format(name, n)
+        for name, rate in report['hit_rates'].items():
+            msg += '\n{:<32} {:>9.1%}'.format(name + ' hit rate', rate)
+        for name, saved in report['saved_s'].items():
+            # share of the busy time the run would have taken without the cache
+            uncached_time = report['busy_s'] + saved
+            msg += '\n{:<32} {:>9.3f} s {:>6.1%} (estimated: hits x mean miss time)'.format(
+                name + ' saved', saved, saved / uncached_time if uncached_time else 0.)
+        logger.info(msg)
+        return report
@@ -0,0 +1,220 @@
+import os
+import gzip
+import glob
+from typing import List, Tuple
+
+import yaml
+from codetext.utils import module_available
+
+from .io import loads
+
+
+_PYARROW_AVAILABLE = module_available("pyarrow")
+_ZSTD_AVAILABLE = module_available("zstandard")
+
+if _PYARROW_AVAILABLE:
+    import pyarrow.parquet as pq
+
+if _ZSTD_AVAILABLE:
+    import zstandard
+
+
+MAIN_FIELDS = ['repo', 'path', 'language']
+
+
+def count_lines_offset(filepath: str, n_line: int) -> int:
+    """
+    Get the byte offset right after the first `n_line` lines of a file
+
+    Args:
+        filepath (str): path to .jsonl file
+        n_line (int): number of line
+
+    Returns:
+        int: byte offset (file size if the file has less than `n_line` lines)
+    """
+    offset = 0
+    with open(filepath, 'rb') as file:
+        for idx, line in enumerate(file):
+            if idx >= n_line:
+                break
+            offset += len(line)
+    return offset
+
+
+def get_jsonl_shards(filepath: str, n_split: int, n_sample: int=None) -> List[Tuple[str, int, int]]:
+    """
+    Split a .jsonl file into byte-offset shards, each shard start and end at
+    a line boundary so that every worker can read its own range independently
+
+    Args:
+        filepath (str): path to .jsonl file
+        n_split (int): expected number of shard
+        n_sample (int): only use the first `n_sample` lines (default to all)
+
+    Returns:
+        List[Tuple[str, int, int]]: list of shard (file, start byte, end byte)
+    """
+    file_size = os.path.getsize(filepath)
+    if n_sample:
+        file_size = count_lines_offset(filepath, n_sample)
+
+    n_split = max(1, n_split)
+    step = max(1, file_size // n_split)
+
+    boundaries = [0]
+    with open(filepath, 'rb') as file:
+        for position in range(step, file_size, step):
+            if position <= boundaries[-1]:
+                continue
+            # move to the beginning of the next line
+            file.seek(position - 1)
+            file.readline()
+            position = file.tell()
+            if position >= file_size:
+                break
+            boundaries.append(position)
+    boundaries.append(file_size)
+
+    return [(filepath, start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+
+def read_jsonl_shard(filepath: str, start: int, end: int):
+    """
+    Read and parse a byte range of a .jsonl file line by line
+
+    Args:
+        filepath (str): path to .jsonl file
+        start (int): start byte (at a line boundary)
+        end (int): end byte (at a line boundary)
+
+    Yields:
+        Dict: parsed json object
+    """
+    with open(filepath, 'rb') as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            if not line.strip():
+                continue
+            yield loads(line)
+
+
+def read_jsonl_file(filepath: str):
+    """
+    Read and parse a (.gz or .zst compressed) .jsonl file line by line
+
+    Yields:
+        Dict: parsed json object
+    """
+    if filepath.endswith('.gz'):
+        file = gzip.open(filepath, 'rb')
+    elif filepath.endswith('.zst'):
+        assert _ZSTD_AVAILABLE, "`zstandard` is not installed, try `pip install zstandard`"
+        file = zstandard.open(filepath, 'rb')
+    else:
+        file = open(filepath, 'rb')
+    
+    with file:
+        for line in file:
+            if not line.strip():
+                continue
+            yield loads(line)
+
+
+def is_parquet(data_path: str) -> bool:
+    """Check if `data_path` is a .parquet file or a folder of .parquet files"""
+    if os.path.isdir(data_path):
+        return len(glob.glob(os.path.join(data_path, '*.parquet'))) > 0
+    return str(data_path).endswith('.parquet')
+
+
+def get_parquet_shards(data_path: str, n_sample: int=None) -> List[Tuple[str, int, int, int]]:
+    """
+    Split .parquet file(s) into row group shards, only the metadata (footer)
+    of each file is read
+
+    Args:
+        data_path (str): .parquet file or folder contains .parquet files
+        n_sample (int): only use the first `n_sample` rows (default to all)
+
+    Returns:
+        List[Tuple[str, int, int, int]]: list of shard (file, row group,
+            number of row to read, byte size of the row group)
+    """
+    assert _PYARROW_AVAILABLE, "`pyarrow` is not installed, try `pip install pyarrow`"
+    if os.path.isdir(data_path):
+        files = sorted(glob.glob(os.path.join(data_path, '*.parquet')))
+    else:
+        files = [data_path]
+
+    shards = []
+    n_row = 0
+    for filepath in files:
+        metadata = pq.ParquetFile(filepath).metadata
+        for row_group in range(metadata.num_row_groups):
+            group = metadata.row_group(row_group)
+            num_rows = group.num_rows
+            if n_sample:
+                num_rows = min(num_rows, n_sample - n_row)
+                if num_rows <= 0:
+                    return shards
+            shards.append((filepath, row_group, num_rows, group.total_byte_size))
+            n_row += num_rows
+    return shards
+
+
+def read_parquet_shard(filepath: str, row_group: int, num_rows: int, 
+                       byte_size: int=None, columns: List[str]=None, batch_size: int=1024):
+    """
+    Read a row group of a .parquet file batch by batch, only the projected
+    columns are loaded
+
+    Args:
+        filepath (str): path to .parquet file
+        row_group (int): row group index
+        num_rows (int): number of row to read
+        byte_size (int): unused, size of the row group (for scheduling)
+        columns (List[str]): columns to read (default to all)
+        batch_size (int): number of row per record batch
+
+    Yields:
+        Dict: a row
+    """
+    assert _PYARROW_AVAILABLE, "`pyarrow` is not installed, try `pip install pyarrow`"
+    parquet_file = pq.ParquetFile(filepath)
+    n_row = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=[row_group], columns=columns):
+        for row in batch.to_pylist():
+            if n_row >= num_rows:
+                return
+            n_row += 1
+            yield row
+
+
+def load_data_format(filepath: str) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """
+    Load data format (.yaml file) once and compile it into field accessors
+
+    Args:
+        filepath (str): path to .yaml file contains data format
+
+    Returns:
+        Tuple[str, Tuple[Tuple[str, str], ...]]: source key of the code and
+            (output key, source key) pairs of the metadata, main content
+            (repo, path, language) first then additional content
+    """
+    assert os.path.exists(filepath), "Not found data format (.yaml file)"
+    with open(filepath, 'r') as stream:
+        data_format = yaml.safe_load(stream)
+
+    fields = [(key, data_format[key]) for key in MAIN_FIELDS]
+    for key, source_key in data_format.items():
+        if key not in ['code'] + MAIN_FIELDS:
+            fields.append((key, source_key))
+
+    return data_format['code'], tuple(fields)
@@ -0,0 +1,53 @@
+import logging
+from typing import Dict, List
+
+import numpy as np
+
+
+logger = logging.getLogger('utils')
+
+
+def split_by_size(sizes, n_split: int) -> List[range]:
+    """
+    Split a list of samples into contiguous chunks of roughly equal total
+    size (instead of equal number of sample)
+
+    Args:
+        sizes (List[int] or np.ndarray): size of each sample (e.g. `size` field of The Stack)
+        n_split (int): expected number of chunk
+
+    Returns:
+        List[range]: list of index range
+    """
+    cumsum = np.cumsum(np.asarray(sizes, dtype=np.int64))
+    if len(cumsum) == 0:
+        return []
+    n_split = max(1, min(n_split, len(cumsum)))
+    targets = cumsum[-1] * np.arange(1, n_split) / n_split
+    boundaries = np.searchsorted(cumsum, targets, side='left') + 1
+    boundaries = [0] + sorted(set(int(x) for x in boundaries if 0 < x < len(cumsum))) + [len(cumsum)]
+    return [range(start, end) for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+
+def order_by_cost(jobs: List, costs: List[int]) -> List:
+    """Sort jobs longest-first so that the big ones do not end up as stragglers"""
+    order = sorted(range(len(jobs)), key=lambda idx: costs[idx], reverse=True)
+    return [jobs[idx] for idx in order]
+
+
+def report_utilization(busy_time: Dict[int, float], wall_time: float):
+    """
+    Log busy time and utilization of each worker
+
+    Args:
+        busy_time (Dict[int, float]): {worker pid: total processing time}
+        wall_time (float): wall time of the whole pool
+    """
+    if not busy_time or wall_time <= 0:
+        return
+    msg = '====== Worker utilization ======'
+    for pid, busy in sorted(busy_time.items()):
+        msg += '\nWorker {}: busy {:.3f} s | utilization {:.1%}'.format(pid, busy, busy / wall_time)
+    average = sum(busy_time.values()) / len(busy_time) / wall_time
+    msg += '\nAverage utilization {:.1%} over {} workers'.format(average, len(busy_time))
+    logger.info(msg)
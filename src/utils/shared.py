@@ -0,0 +1,121 @@
+import os
+import mmap
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .io import loads
+
+
+def build_line_offsets(filepath: str, n_sample: int=None, chunk_size: int=64*1024*1024) -> np.ndarray:
+    """
+    Get the byte offset of every line of a .jsonl file by scanning the
+    memory-mapped file for newlines, chunk by chunk
+
+    Args:
+        filepath (str): path to .jsonl file
+        n_sample (int): only index the first `n_sample` lines (default to all)
+        chunk_size (int): number of bytes scanned at once
+
+    Returns:
+        np.ndarray: int64 array of `n_line + 1` offsets, line `i` is
+            `offsets[i]:offsets[i + 1]`
+    """
+    file_size = os.path.getsize(filepath)
+    ends = [np.zeros(1, dtype=np.int64)]
+    if file_size > 0:
+        with open(filepath, 'rb') as file, \
+             mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for position in range(0, file_size, chunk_size):
+                block = np.frombuffer(buffer, dtype=np.uint8, offset=position,
+                                      count=min(chunk_size, file_size - position))
+                ends.append(np.flatnonzero(block == ord('\n')).astype(np.int64) + position + 1)
+                del block  # release the buffer before closing the mmap
+        if ends[-1].size == 0 or ends[-1][-1] != file_size:
+            # last line without trailing newline
+            ends.append(np.array([file_size], dtype=np.int64))
+
+    offsets = np.concatenate(ends)
+    if n_sample:
+        offsets = offsets[:n_sample + 1]
+    return offsets
+
+
+class SharedLineIndex:
+    """
+    Line offsets of a .jsonl file kept in shared memory. The parent builds
+    the index once, the handle itself only pickles (file, shared memory name,
+    number of line), so a task can carry a (start, end) line range instead
+    of the data. Workers attach to the offsets and memory-map the file on
+    first use, under `fork` as well as `spawn`.
+
+    Args:
+        filepath (str): path to .jsonl file
+        n_sample (int): only index the first `n_sample` lines (default to all)
+    """
+    def __init__(self, filepath: str, n_sample: int=None):
+        offsets = build_line_offsets(filepath, n_sample)
+        self.filepath = filepath
+        self.n_line = len(offsets) - 1
+
+        self._shm = shared_memory.SharedMemory(create=True, size=offsets.nbytes)
+        self._offsets = np.ndarray(offsets.shape, dtype=np.int64, buffer=self._shm.buf)
+        self._offsets[:] = offsets
+        self._mmap = None
+        self._owner = True
+        self.name = self._shm.name
+
+    def __getstate__(self):
+        return {'filepath': self.filepath, 'n_line': self.n_line, 'name': self.name}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+        self._offsets = None
+        self._mmap = None
+        self._owner = False
+
+    def __len__(self):
+        return self.n_line
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+            self._offsets = np.ndarray((self.n_line + 1,), dtype=np.int64, buffer=self._shm.buf)
+        return self._offsets
+
+    def line_sizes(self) -> np.ndarray:
+        """Size in bytes of every line"""
+        return np.diff(self.offsets)
+
+    def read(self, start: int, end: int):
+        """
+        Read and parse lines `start` to `end` (excluded)
+
+        Yields:
+            Dict: parsed json object
+        """
+        if self.n_line == 0:
+            return
+        if self._mmap is None:
+            with open(self.filepath, 'rb') as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        offsets = self.offsets
+        for idx in range(start, min(end, self.n_line)):
+            line = self._mmap[offsets[idx]:offsets[idx + 1]]
+            if not line.strip():
+                continue
+            yield loads(line)
+
+    def close(self):
+        """Detach from the shared memory, the owner (parent) also frees it"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._shm is not None:
+            self._offsets = None
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+            self._shm = None
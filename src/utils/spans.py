@@ -0,0 +1,62 @@
+from typing import List, Tuple
+
+
+def count_code_lines(code: str, comment_rows: List[Tuple[int, int]]) -> int:
+    """
+    Count the non-empty lines of `code` that no comment touches. Comment
+    lines are marked from the (start, end) rows of the comments in one pass,
+    so the cost is O(lines + comment rows) instead of matching every comment
+    text against every line. Lines are counted as `str.splitlines` pieces
+    (e.g. a `\r` or form feed also breaks a line)
+
+    Args:
+        code (str): source code of a node
+        comment_rows (List[Tuple[int, int]]): first and last row (inclusive)
+            of each comment, relative to the first line of `code`
+    """
+    lines = code.split('\n')
+    covered = bytearray(len(lines))
+    for start, end in comment_rows:
+        start, end = max(start, 0), min(end, len(lines) - 1)
+        if start <= end:
+            covered[start:end + 1] = b'\x01' * (end - start + 1)
+    return sum(1 for line, is_comment in zip(lines, covered) if not is_comment
+               for piece in line.splitlines() if piece != '')
+
+
+def find_comment_spans(code: str, comments: List[str]) -> List[Tuple[int, int]]:
+    """
+    Locate comments (in source order, e.g. the `comment` field of a record)
+    in `code` with a single forward scan. A comment not found after the
+    previous one is searched from the start
+
+    Returns:
+        List[Tuple[int, int]]: sorted (start, end) offsets of the comments
+    """
+    spans = []
+    position = 0
+    for comment in comments:
+        if not comment:
+            continue
+        start = code.find(comment, position)
+        if start == -1:
+            start = code.find(comment)
+            if start == -1:
+                continue
+        else:
+            position = start + len(comment)
+        spans.append((start, start + len(comment)))
+    spans.sort()
+    return spans
+
+
+def remove_spans(code: str, spans: List[Tuple[int, int]]) -> str:
+    """Remove sorted, possibly overlapping (start, end) spans from `code` in one pass"""
+    pieces = []
+    position = 0
+    for start, end in spans:
+        if start > position:
+            pieces.append(code[position:start])
+        position = max(position, end)
+    pieces.append(code[position:])
+    return ''.join(pieces)
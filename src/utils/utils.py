@@ -1,7 +1,9 @@
+import re
 import json
 import os
 import subprocess
 import logging
+import threading
 from pathlib import Path
 from typing import List, Dict, Any, Union
 
@@ -11,13 +13,17 @@ from tree_sitter import Language, Parser
 
 from codetext.utils import module_available
 from codetext.clean import remove_comment_delimiters
-from codetext.parser.language_parser import match_from_span, match_from_spans, tokenize_code, tokenize_docstring
-from utils.noise_removal.noise_removal import check_function, clean_docstring
+from codetext.parser.language_parser import tokenize_docstring, traverse
+# relative imports: the package is loaded once, as `src.utils` (processing)
+# or `utils` (postprocess scripts), so the grammar stamp cache is not duplicated
+from .noise_removal.noise_removal import check_function, clean_docstring
+from .spans import count_code_lines
+from .grammar import get_grammar_path
 
 
 _DOCSTRING_PARSER_AVAILABLE = module_available("docstring_parser")
 
-ROOT_PATH = str(Path(__file__).parents[3])
+ROOT_PATH = str(Path(__file__).parents[2])
 
 logger = logging.getLogger('utils')
 logging.basicConfig(level = logging.INFO)
@@ -42,6 +48,18 @@ if _DOCSTRING_PARSER_AVAILABLE:
         'rust': [DocstringStyle.RUSTDOC,
                 DocstringStyle.JAVADOC], 
     }
+    # Loose markers of the meta sections each style parses (a style yields
+    # no meta when its marker is missing). Styles without a marker are never
+    # pre-classified
+    STYLE_MARKERS = {
+        DocstringStyle.REST: re.compile(r'^\s*:', re.M),
+        DocstringStyle.GOOGLE: re.compile(r'^\s*[A-Z][\w ]*:\s*$', re.M),
+        DocstringStyle.NUMPYDOC: re.compile(r'^\s*(-+|\.\..*::.*)\s*$', re.M),
+        DocstringStyle.EPYDOC: re.compile(r'@'),
+        DocstringStyle.JAVADOC: re.compile(r'@'),
+        DocstringStyle.XML: re.compile(r'<'),
+        DocstringStyle.RUSTDOC: re.compile(r'#'),
+    }
 else:
     logger.warning("`docstring_parser` is not available.")
 
@@ -83,9 +101,65 @@ def build_language(language: str, save_path: str=ROOT_PATH):
         assert os.path.exists(lang_path)==True
         
     
+# Process-local registry of tree-sitter languages, each .so is loaded once.
+# `tree_sitter.Parser` is not thread-safe, parsers are cached per thread
+_TS_LANGUAGES = {}
+_TS_LANGUAGES_LOCK = threading.Lock()
+_TS_PARSERS = threading.local()
+
+
+def normalize_language(language: str) -> str:
+    """Lowercase language name used by tree-sitter (e.g: C++ -> cpp, C# -> c_sharp)"""
+    language = str(language).lower()
+    if language == 'c#':
+        language = 'c_sharp'
+    elif language == 'c++':
+        language = 'cpp'
+    return language
+
+
+def get_ts_language(language: str) -> Language:
+    """
+    Get the tree-sitter `Language` of a language, load (and build if
+    missing) its .so file on the first call only
+    
+    Args:
+        language (str): language name (e.g: Python, C++, c_sharp)
+    """
+    language = normalize_language(language)
+    ts_language = _TS_LANGUAGES.get(language)
+    if ts_language is not None:
+        return ts_language
+    
+    with _TS_LANGUAGES_LOCK:
+        if language not in _TS_LANGUAGES:
+            # prebuilt bundle (see `utils/grammar.py`) or <language>.so
+            ts_lang_path = get_grammar_path(language, os.path.join(ROOT_PATH, 'tree-sitter'))
+            if not os.path.exists(ts_lang_path):
+                build_language(language)
+            _TS_LANGUAGES[language] = Language(ts_lang_path, language)
+        return _TS_LANGUAGES[language]
+
+
+def get_ts_parser(language: str) -> Parser:
+    """Get the `tree_sitter.Parser` of a language, one per thread and language"""
+    language = normalize_language(language)
+    parsers = getattr(_TS_PARSERS, 'parsers', None)
+    if parsers is None:
+        parsers = _TS_PARSERS.parsers = {}
+    
+    parser = parsers.get(language)
+    if parser is None:
+        parser = Parser()
+        parser.set_language(get_ts_language(language))
+        parsers[language] = parser
+    return parser
+
+
 def parse_code(raw_code: str, language: str='Auto') -> tree_sitter.Tree:
     """
-    Auto parse raw code into `tree_sitter.Tree`
+    Auto parse raw code into `tree_sitter.Tree`, the parser is cached (see
+    `get_ts_parser`)
     
     Args:
         raw_code (str): Raw source code need to parse
@@ -95,27 +169,29 @@ def parse_code(raw_code: str, language: str='Auto') -> tree_sitter.Tree:
     if language == 'Auto':
         raise NotImplemented()
     
-    language = str(language).lower()
-    if language == 'c#':
-        language = 'c_sharp'
-    elif language == 'c++':
-        language = 'cpp'
-            
-    ts_lang_path = os.path.join(ROOT_PATH, 'tree-sitter', f'{language}.so')
-    if not os.path.exists(ts_lang_path):
-        build_language(language)
-        
-    parser = Parser()
-    language = Language(ROOT_PATH + f"/tree-sitter/{language}.so", language)
-    parser.set_language(language)
-    
     if isinstance(raw_code, str):
-        tree = parser.parse(bytes(raw_code, 'utf8'))
-        return tree
+        return get_ts_parser(language).parse(bytes(raw_code, 'utf8'))
     else:
         raise ValueError(f"Expect `str`, got {type(raw_code)}")
 
 
+def parse_many(codes: List[str], language: str) -> List[tree_sitter.Tree]:
+    """
+    Parse a list of snippets of the same language with one parser
+    
+    Args:
+        codes (List[str]): source codes
+        language (str): Language to load parser
+    """
+    parser = get_ts_parser(language)
+    trees = []
+    for raw_code in codes:
+        if not isinstance(raw_code, str):
+            raise ValueError(f"Expect `str`, got {type(raw_code)}")
+        trees.append(parser.parse(bytes(raw_code, 'utf8')))
+    return trees
+
+
 def get_first_sentence(paragraph):
     """
     Returns the first sentence of a given paragraph of text.
@@ -135,12 +211,19 @@ def get_first_sentence(paragraph):
     return ''
 
 
-def process_raw_node(tree, blob: str, language_parser, metadata, is_class=False):
+def get_node_text(buffer: memoryview, node) -> str:
+    """Text of a node, sliced by byte offsets from the utf-8 encoded source"""
+    return str(buffer[node.start_byte:node.end_byte], 'utf8')
+
+
+def process_raw_node(tree, blob: Union[str, bytes], language_parser, metadata, is_class=False):
     """
-    Process all extractable functions or class
+    Process all extractable functions or class. Node texts are sliced by
+    byte offsets from the encoded source (pass the bytes given to the
+    parser to skip encoding it again)
     Args:
         tree (tree_sitter.Tree): Tree AST of source code
-        blob (str): source code
+        blob (str or bytes): source code
         language_parser (LanguageParser): Language parser (`utils/parser`)
         metadata (Dict): file metadata
     Returns:
@@ -164,6 +247,7 @@ def process_raw_node(tree, blob: str, language_parser, metadata, is_class=False)
     except Exception:
         return []
 
+    buffer = memoryview(blob if isinstance(blob, bytes) else bytes(blob, 'utf8'))
     outputs = []
     for function in node_list:
         try:
@@ -185,30 +269,27 @@ def process_raw_node(tree, blob: str, language_parser, metadata, is_class=False)
             comment_nodes = language_parser.get_comment_node(function)
             docstring_node = language_parser.get_docstring_node(function)
             
-            exclude_node = []
+            exclude_ids = set()
             if docstring_node:
-                exclude_node.extend(docstring_node)
+                exclude_ids.update(node.id for node in docstring_node)
             if comment_nodes:
-                exclude_node.extend(comment_nodes)
+                exclude_ids.update(node.id for node in comment_nodes)
             
             docstring = language_parser.get_docstring(function)
-            code = match_from_span(function, blob)
-            code_tokens = tokenize_code(function, blob, exclude_node)
+            code = get_node_text(buffer, function)
+            tokens = []
+            traverse(function, tokens)
+            code_tokens = [get_node_text(buffer, token) for token in tokens if token.id not in exclude_ids]
             
-            comment_list = [match_from_span(cmt, blob) for cmt in comment_nodes]
+            comment_list = [get_node_text(buffer, cmt) for cmt in comment_nodes]
             
-            # Check length after remove all comment node inside
-            code_remove_comment = ''
-            for line in str(code).splitlines():
-                include = False
-                for cline in comment_list:
-                    if cline in line:
-                        include = True
-                if not include:
-                    code_remove_comment += f'\n{line}'
-
-            code_remove_comment_line = sum([1 if line != '' else 0 \
-                for line in str(code_remove_comment).splitlines()])
+            # Check length after remove all comment lines inside: only the
+            # lines of comments written on a single line are dropped, so a
+            # multi-line docstring or block comment still counts as code
+            fn_line_start = function.start_point[0]
+            comment_rows = [(cmt.start_point[0] - fn_line_start, cmt.end_point[0] - fn_line_start)
+                            for cmt in comment_nodes if cmt.start_point[0] == cmt.end_point[0]]
+            code_remove_comment_line = count_code_lines(code, comment_rows)
             if code_remove_comment_line < 3:
                 continue
 
@@ -235,12 +316,12 @@ def process_raw_node(tree, blob: str, language_parser, metadata, is_class=False)
         yield fn_metadata
         
         
-def get_node_definitions(metadata: List) -> List:
+def get_node_definitions(metadata: List, cache=None) -> List:
     """
     Filter non-quality node by docstring 
     Args:
         metadata (List): List of function or class metadata
-        blob (str): source code
+        cache (DocstringCache): memoize `clean_docstring` of duplicate docstrings
     Returns:
         List[str]: List contains these keys
             - 'identifier'
@@ -261,7 +342,12 @@ def get_node_definitions(metadata: List) -> List:
             continue
         
         # change clean_comment -> clean_docstring
-        docstring = clean_docstring(docstring, code)
+        if cache is None:
+            docstring = clean_docstring(docstring, code)
+        else:
+            # `code` is only used as the (truthy) `loosen_filter`
+            docstring = cache.get(('clean_docstring', docstring, bool(code)),
+                                  lambda: clean_docstring(docstring, code))
         if docstring == None:  # Non-literal, Interrogation, UnderDevlop, auto code or no-docstring
             continue
         
@@ -276,9 +362,65 @@ def get_node_definitions(metadata: List) -> List:
         yield node_metadata
         
 
+def get_span_text(lines: List[str], start_point, end_point) -> str:
+    """`match_from_span` on the source already split into lines"""
+    line_start, char_start = start_point
+    line_end, char_end = end_point
+    if line_start != line_end:
+        return '\n'.join([lines[line_start][char_start:]] + lines[line_start+1:line_end] + [lines[line_end][:char_end]])
+    return lines[line_start][char_start:char_end]
+
+
+def get_context_span(nodes: List):
+    """First and last node of `match_from_spans` for consecutive sibling nodes"""
+    top = bottom = nodes[0]
+    for node in nodes:
+        if node.end_point[0] > bottom.end_point[0]:
+            bottom = node
+    return top, bottom
+
+
+def get_sibling_index(parent):
+    """
+    Children of a node with, for each position, where the run of siblings
+    around it starts (`prev_start`) and ends (`next_end`), so the contexts of
+    a comment are slices. A run stops before a comment and at a MISSING
+    node (kept), as the former sibling walk did: `prev_sibling` and
+    `next_sibling` of a zero-width MISSING node are None
+    """
+    children = parent.children
+    n_child = len(children)
+    is_comment = [child.type == 'comment' for child in children]
+    
+    prev_start = [0] * n_child
+    start = 0
+    for idx, child in enumerate(children):
+        if is_comment[idx]:
+            start = idx + 1
+        elif child.is_missing:
+            start = idx
+        prev_start[idx] = start
+    
+    next_end = [n_child] * (n_child + 1)
+    for idx in range(n_child - 1, -1, -1):
+        if is_comment[idx]:
+            next_end[idx] = idx
+        elif children[idx].is_missing:
+            next_end[idx] = idx + 1
+        else:
+            next_end[idx] = next_end[idx + 1]
+    
+    position = {child.id: idx for idx, child in enumerate(children)}
+    return children, is_comment, prev_start, next_end, position
+
+
 def get_line_definitions(tree, blob: str, language_parser, source_metadata):
         """
-        Process all extractable functions or class
+        Process all extractable functions or class. The source is split into
+        lines once and the siblings of each comment block are indexed once,
+        so the contexts of every comment are found in a single pass over the
+        function (instead of walking the siblings and re-splitting the
+        source for each comment)
         Args:
             tree (tree_sitter.Tree): AST of the source code
             blob (str): source code
@@ -295,6 +437,7 @@ def get_line_definitions(tree, blob: str, language_parser, source_metadata):
                 - 'comment'
                 - 'comment_tokens'
         """
+        lines = blob.split('\n')
         function_list = language_parser.get_function_list(tree.root_node)
         
         for function_node in function_list:
@@ -303,81 +446,67 @@ def get_line_definitions(tree, blob: str, language_parser, source_metadata):
             if not comment_nodes:
                 continue
             
+            comment_ids = {node.id for node in comment_nodes}
+            tokens = []
+            traverse(function_node, tokens)
             
             general_metadata = source_metadata
             general_metadata.update({
                 'identifier': language_parser.get_function_metadata(function_node)['identifier'],
-                'code': match_from_span(function_node, blob),
-                'code_tokens': tokenize_code(function_node, blob, comment_nodes),
+                'code': get_span_text(lines, function_node.start_point, function_node.end_point),
+                'code_tokens': [get_span_text(lines, token.start_point, token.end_point)
+                                for token in tokens if token.id not in comment_ids],
             })
             
             fn_line_start = function_node.start_point[0]
+            # parent id -> `get_sibling_index`, shared by the comments of a block
+            blocks = {}
             
             # remove duplicate sample then extract
             for comment_node in comment_nodes:
-                comment_metadata = general_metadata.copy()
+                parent = comment_node.parent
+                if parent is None:
+                    continue
+                if parent.id not in blocks:
+                    blocks[parent.id] = get_sibling_index(parent)
+                children, is_comment, prev_start, next_end, position = blocks[parent.id]
+                idx = position[comment_node.id]
                 
-                comments = [match_from_span(comment_node, blob)]
-                prev_node = comment_node.prev_sibling
-                next_node = comment_node.next_sibling
+                # part of the comment block starting at a previous comment
+                if idx > 0 and is_comment[idx - 1]:
+                    continue
+                
+                comment_metadata = general_metadata.copy()
+                comments = [get_span_text(lines, comment_node.start_point, comment_node.end_point)]
                 
                 comment_metadata['prev_context'] = {}
                 comment_metadata['next_context'] = {}
-                comment_metadata['start_point'] = list(comment_node.start_point) #[0] - fn_line_start, comment_node.start_point[1]]
-                comment_metadata['end_point'] = list(comment_node.end_point) #[0] - fn_line_start, comment_node.end_point[1]]
-                
-                prev_context = []
-                if prev_node:
-                    # check if prev_node is comment to append comment list
-                    # while prev_node.type == 'comment':
-                    #     comments.insert(0, match_from_span(prev_node, blob))
-                    #     comment_metadata['start_point'] = list(prev_node.start_point)
-                    #     prev_node = prev_node.prev_sibling
-                    #     if not prev_node:
-                    #         break
-                    if prev_node.type == 'comment':
-                        continue
-
-                    # if not meet the open bracket
-                    while prev_node:
-                        prev_context.insert(0, prev_node)
-                        prev_node = prev_node.prev_sibling
-                        if not prev_node:
-                            break
-                        elif prev_node.type == 'comment':
-                            break
+                comment_metadata['start_point'] = list(comment_node.start_point)
+                comment_metadata['end_point'] = list(comment_node.end_point)
                 
+                # non-comment siblings up to the previous comment
+                prev_context = children[prev_start[idx - 1]:idx] if idx > 0 else []
                 if prev_context:
-                    code, top, bottom = match_from_spans(prev_context, blob)
+                    top, bottom = get_context_span(prev_context)
                     comment_metadata['prev_context'] = {
-                        'code': code,
+                        'code': get_span_text(lines, top.start_point, bottom.end_point),
                         'start_point': [top.start_point[0] - fn_line_start, top.start_point[1]],
                         'end_point': [bottom.end_point[0] - fn_line_start, bottom.end_point[1]],
                     }
                 
-                next_context = []
-                if next_node:
-                    while next_node.type == 'comment':
-                        comments.append(match_from_span(next_node, blob))
-                        comment_metadata['end_point'] = list(next_node.start_point)
-                        next_node = next_node.next_sibling    
-                        if not next_node:
-                            break
-                        
-                    # while not meet the other comment or not reach the end node
-                    # keep appending
-                    while next_node:
-                        next_context.append(next_node)
-                        next_node = next_node.next_sibling
-                        if not next_node:
-                            break 
-                        elif next_node.type == 'comment':
-                            break
-                    
+                # following comments join the block, then non-comment siblings up to the next comment
+                next_idx = idx + 1
+                while next_idx < len(children) and is_comment[next_idx]:
+                    next_node = children[next_idx]
+                    comments.append(get_span_text(lines, next_node.start_point, next_node.end_point))
+                    comment_metadata['end_point'] = list(next_node.start_point)
+                    next_idx += 1
+                
+                next_context = children[next_idx:next_end[next_idx]]
                 if next_context:
-                    code, top, bottom = match_from_spans(next_context, blob)
+                    top, bottom = get_context_span(next_context)
                     comment_metadata['next_context'] = {
-                        'code': code,
+                        'code': get_span_text(lines, top.start_point, bottom.end_point),
                         'start_point': [top.start_point[0] - fn_line_start, top.start_point[1]],
                         'end_point': [bottom.end_point[0] - fn_line_start, bottom.end_point[1]],
                     }
@@ -399,11 +528,12 @@ def get_line_definitions(tree, blob: str, language_parser, source_metadata):
                 yield comment_metadata
 
 
-def extract_node(metadata_list, language:str):
+def extract_node(metadata_list, language:str, cache=None):
     """Get metadata as input and parse docstring into metadata
     
     Args:
         metadata (Dict): Metadata
+        cache (DocstringCache): memoize `extract_docstring` of duplicate docstrings
     
     Returns: 
         Dict[str, Any]: Extracted docstring and metadata, contains:
@@ -441,7 +571,11 @@ def extract_node(metadata_list, language:str):
             'comment': metadata['comment']
         })
         docstring = remove_comment_delimiters(metadata['original_docstring'], False)
-        extracted_res = extract_docstring(docstring, metadata['parameters'], language)
+        if cache is None:
+            extracted_res = extract_docstring(docstring, metadata['parameters'], language)
+        else:
+            extracted_res = cache.get(('extract_docstring', docstring, language, metadata['parameters']),
+                                      lambda: extract_docstring(docstring, metadata['parameters'], language))
         if not extracted_res:  # extract fail
             continue
         if extracted_res['docstring'] == '' or not extracted_res['docstring']:
@@ -511,6 +645,65 @@ def check_fn_cls_output(output):
     return True
 
 
+def detect_docstring_style(docstring: str, styles: List) -> Any:
+    """
+    Guess the style of a docstring from the markers of `styles`, without
+    parsing it
+
+    Returns:
+        DocstringStyle: the only style whose marker is found (the first style
+            if none is found), None if ambiguous
+    """
+    if len(styles) == 1:
+        return styles[0]
+    if any(style not in STYLE_MARKERS for style in styles):
+        return None
+    found = [style for style in styles if STYLE_MARKERS[style].search(docstring)]
+    if not found:
+        return styles[0]
+    return found[0] if len(found) == 1 else None
+
+
+def parse_docstring(docstring: str, styles: List) -> Any:
+    """
+    Parse a docstring with the style yielding the most meta (first style on
+    ties). The detected style is parsed first; the other styles are only
+    parsed when its result could be beaten (ambiguous markers, no meta or
+    parse error)
+
+    Returns:
+        Docstring: parsed docstring, None if no style can parse it
+    """
+    style = detect_docstring_style(docstring, styles)
+    detected = None
+    if style is not None:
+        try:
+            detected = parse(docstring, style)
+        except ParseError:
+            pass
+        except Exception:
+            return None
+        else:
+            # the other styles have no marker, hence no meta
+            if len(detected.meta) > 0 or style == styles[0]:
+                return detected
+
+    rets = []
+    for other in styles:
+        if other == style:
+            if detected is not None:
+                rets.append(detected)
+            continue
+        try:
+            rets.append(parse(docstring, other))
+        except ParseError:
+            pass
+        except Exception:
+            return None
+    rets = sorted(rets, key=lambda d: len(d.meta), reverse=True)
+    return rets[0] if rets else None
+
+
 def extract_docstring(docstring: str, parameter_list: Union[List, Dict], language: str) -> Dict[str, Any]:
     """Extract docstring into parameter docstring
         
@@ -564,25 +757,9 @@ def extract_docstring(docstring: str, parameter_list: Union[List, Dict], languag
             # metadata['docstring_params'][key] = {'docstring': None, 'type': val, 'docstring_tokens': []}
     
     # Extract docstring
-    docstring_style_list = STYLE_MAP[language]
-    rets = []
-    
-    try:
-        for style in docstring_style_list:
-            try:
-                ret = parse(docstring, style)
-                # break
-            except ParseError:
-                pass
-            else:
-                rets.append(ret)
-    except Exception:
-        return None
-    extract_docstring = sorted(rets, key=lambda d: len(d.meta), reverse=True)
-    
-    if len(extract_docstring) < 1:
+    extract_docstring = parse_docstring(docstring, STYLE_MAP[language])
+    if extract_docstring is None:
         return None  # unable to parse
-    extract_docstring = extract_docstring[0]
     
     assert isinstance(extract_docstring, Docstring)
     
@@ -0,0 +1,546 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+from typing import Dict, List
+
+from codetext.utils import module_available
+
+from .io import dumps_bytes
+
+
+_ZSTD_AVAILABLE = module_available("zstandard")
+_PYARROW_AVAILABLE = module_available("pyarrow")
+
+if _ZSTD_AVAILABLE:
+    import zstandard
+
+if _PYARROW_AVAILABLE:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+logger = logging.getLogger('utils')
+
+
+COMPRESSION_EXTENSION = {
+    None: '',
+    'none': '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+PARQUET_COMPRESSION = {
+    None: 'snappy',
+    'none': 'none',
+    'gzip': 'gzip',
+    'zstd': 'zstd',
+}
+
+
+def get_record_schema(level: str):
+    """
+    Fixed Arrow schema of the function, class and inline records
+    (see `data/README.md`), metadata fields from the data format (e.g.
+    license, stars_count) are appended by `ParquetWriter`
+
+    Args:
+        level (str): function, class or inline
+    """
+    assert _PYARROW_AVAILABLE, "`pyarrow` is not installed, try `pip install pyarrow`"
+    tokens = pa.list_(pa.string())
+    point = pa.list_(pa.int64())
+    
+    main_fields = [
+        ('repo', pa.string()),
+        ('path', pa.string()),
+        ('language', pa.string()),
+        ('identifier', pa.string()),
+        ('code', pa.string()),
+        ('code_tokens', tokens),
+    ]
+    
+    if level == 'inline':
+        context = pa.struct([
+            ('code', pa.string()),
+            ('start_point', point),
+            ('end_point', point),
+        ])
+        return pa.schema(main_fields + [
+            ('prev_context', context),
+            ('next_context', context),
+            ('start_point', point),
+            ('end_point', point),
+            ('original_comment', pa.string()),
+            ('comment', pa.string()),
+            ('comment_tokens', tokens),
+        ])
+
+    param = pa.struct([
+        ('identifier', pa.string()),
+        ('docstring', pa.string()),
+        ('docstring_tokens', tokens),
+        ('type', pa.string()),
+        ('default', pa.string()),
+        ('is_optional', pa.bool_()),
+    ])
+    typed_docstring = pa.struct([
+        ('docstring', pa.string()),
+        ('docstring_tokens', tokens),
+        ('type', pa.string()),
+    ])
+    other = pa.struct([
+        ('identifier', pa.string()),
+        ('docstring', pa.string()),
+        ('docstring_tokens', tokens),
+    ])
+    return pa.schema(main_fields + [
+        ('parameters', pa.map_(pa.string(), pa.string())),
+        ('return_type', pa.string()),
+        ('throws', pa.string()),
+        ('original_docstring', pa.string()),
+        ('comment', tokens),
+        ('docstring', pa.string()),
+        ('docstring_tokens', tokens),
+        ('short_docstring', pa.string()),
+        ('short_docstring_tokens', tokens),
+        ('docstring_params', pa.struct([
+            ('returns', pa.list_(typed_docstring)),
+            ('raises', pa.list_(typed_docstring)),
+            ('params', pa.list_(param)),
+            ('outlier_params', pa.list_(param)),
+            ('others', pa.list_(other)),
+        ])),
+    ])
+
+
+def open_output(save_path: str, compression: str=None, mode: str='ab'):
+    """
+    Open a (compressed) binary output file
+
+    Args:
+        save_path (str): output path (without compression extension)
+        compression (str): None, 'gzip' or 'zstd'
+        mode (str): file mode
+    """
+    if compression == 'gzip':
+        return gzip.open(save_path, mode)
+    elif compression == 'zstd':
+        assert _ZSTD_AVAILABLE, "`zstandard` is not installed, try `pip install zstandard`"
+        return zstandard.open(save_path, mode)
+    elif compression in [None, 'none']:
+        return open(save_path, mode)
+    else:
+        raise ValueError(f'Compression {compression} not supported')
+
+
+def get_output_entry(filepath: str, n_record: int) -> Dict:
+    """
+    Index entry of a closed output file: path, number of records, size on
+    disk and sha256 of the file (same as `sha256sum`)
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return {
+        'path': filepath,
+        'records': n_record,
+        'bytes': os.path.getsize(filepath),
+        'sha256': digest.hexdigest(),
+    }
+
+
+class JsonlWriter:
+    """
+    Buffered .jsonl writer, keep at most `flush_records` records or
+    `flush_bytes` bytes in memory before flushing them to disk. Records
+    are written to a `.tmp` file which is atomically renamed on `close()`,
+    so a crashed run never leaves a partial output under the final name
+
+    Args:
+        save_path (str): output path (compression extension is added)
+        flush_records (int): flush after N buffered records
+        flush_bytes (int): flush after M buffered bytes
+        compression (str): None, 'gzip' or 'zstd'
+    """
+    def __init__(self, save_path: str, flush_records: int=1000,
+                 flush_bytes: int=16*1024*1024, compression: str=None):
+        self.save_path = save_path + COMPRESSION_EXTENSION[compression]
+        self.flush_records = flush_records
+        self.flush_bytes = flush_bytes
+        self.compression = compression
+
+        self.buffer = []
+        self.buffer_size = 0
+        self.n_record = 0
+        self.n_bytes = 0
+        self.tmp_path = self.save_path + '.tmp'
+        self.file = open_output(self.tmp_path, compression, mode='wb')
+
+    def write(self, item):
+        line = dumps_bytes(item) + b'\n'
+        self.buffer.append(line)
+        self.buffer_size += len(line)
+        self.n_record += 1
+        self.n_bytes += len(line)
+
+        if len(self.buffer) >= self.flush_records or self.buffer_size >= self.flush_bytes:
+            self.flush()
+
+    def extend(self, items):
+        for item in items:
+            self.write(item)
+
+    def write_lines(self, lines: bytes, n_record: int):
+        """Write `n_record` already serialized .jsonl lines (see `QueueWriter`)"""
+        self.buffer.append(lines)
+        self.buffer_size += len(lines)
+        self.n_record += n_record
+        self.n_bytes += len(lines)
+
+        if self.buffer_size >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(b''.join(self.buffer))
+            self.file.flush()
+        self.buffer = []
+        self.buffer_size = 0
+
+    def close(self) -> Dict:
+        """Flush, rename to the final name and return the index entry"""
+        self.flush()
+        self.file.close()
+        os.replace(self.tmp_path, self.save_path)
+        return get_output_entry(self.save_path, self.n_record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ParquetWriter:
+    """
+    Buffered .parquet writer, each flush writes the buffered records as one
+    Arrow record batch (row group) with a fixed schema, so later stages can
+    read only the columns they need. The schema is `get_record_schema(level)`
+    plus the metadata fields found in the first batch. Nothing is written
+    if there is no record.
+
+    Args:
+        save_path (str): output path
+        level (str): function, class or inline
+        flush_records (int): flush after N buffered records
+        flush_bytes (int): flush after M buffered bytes (approximated by code length)
+        compression (str): None (snappy), 'none', 'gzip' or 'zstd'
+    """
+    def __init__(self, save_path: str, level: str, flush_records: int=1000,
+                 flush_bytes: int=16*1024*1024, compression: str=None):
+        assert _PYARROW_AVAILABLE, "`pyarrow` is not installed, try `pip install pyarrow`"
+        self.save_path = save_path
+        self.flush_records = flush_records
+        self.flush_bytes = flush_bytes
+        self.compression = PARQUET_COMPRESSION[compression]
+
+        self.schema = get_record_schema(level)
+        self.buffer = []
+        self.buffer_size = 0
+        self.n_record = 0
+        self.n_bytes = 0
+        self.tmp_path = self.save_path + '.tmp'
+        self.writer = None
+
+    def _update_schema(self, items):
+        """Append metadata fields (not in the fixed schema) of the first batch"""
+        for key in items[0].keys():
+            if self.schema.get_field_index(key) != -1:
+                continue
+            field_type = pa.array([item.get(key) for item in items]).type
+            if pa.types.is_null(field_type):
+                field_type = pa.string()
+            self.schema = self.schema.append(pa.field(key, field_type))
+
+    def write(self, item):
+        self.buffer.append(item)
+        self.buffer_size += len(item.get('code') or '')
+        self.n_record += 1
+        self.n_bytes += len(item.get('code') or '')
+
+        if len(self.buffer) >= self.flush_records or self.buffer_size >= self.flush_bytes:
+            self.flush()
+
+    def extend(self, items):
+        for item in items:
+            self.write(item)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.writer is None:
+            self._update_schema(self.buffer)
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression=self.compression)
+        
+        # empty struct (e.g. inline `prev_context` = {}) is stored as null
+        for field in self.schema:
+            if pa.types.is_struct(field.type):
+                for item in self.buffer:
+                    if item.get(field.name) == {}:
+                        item[field.name] = None
+        
+        table = pa.Table.from_pylist(self.buffer, schema=self.schema)
+        self.writer.write_table(table)
+        self.buffer = []
+        self.buffer_size = 0
+
+    def close(self) -> Dict:
+        """Flush, rename to the final name and return the index entry (None if empty)"""
+        self.flush()
+        # no file for an empty output, its schema would miss the metadata fields
+        if self.writer is None:
+            return None
+        self.writer.close()
+        os.replace(self.tmp_path, self.save_path)
+        return get_output_entry(self.save_path, self.n_record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_writer(save_path: str, level: str, output_format: str='jsonl', **kwargs):
+    """
+    Create an output writer
+
+    Args:
+        save_path (str): output path without extension
+        level (str): function, class or inline
+        output_format (str): jsonl or parquet
+        **kwargs: flush_records, flush_bytes, compression
+    """
+    if output_format == 'parquet':
+        return ParquetWriter(save_path + '.parquet', level, **kwargs)
+    elif output_format == 'jsonl':
+        return JsonlWriter(save_path + '.jsonl', **kwargs)
+    else:
+        raise ValueError(f'Output format {output_format} not supported')
+
+
+class QueueWriter:
+    """
+    Writer of an extraction worker in the asynchronous writer mode: records
+    are serialized (.jsonl) and buffered in the worker, then pushed by batch
+    into a bounded queue. The writer process (`run_writer_process`) does the
+    compression and the disk writes. `put` blocks while the queue is full,
+    which keeps memory bounded.
+
+    Args:
+        queue (multiprocessing.Queue): bounded queue of the writer process
+        save_path (str): output path without extension (see `get_writer`)
+        level (str): function, class or inline
+        output_format (str): jsonl or parquet
+        shard (int): index of the shard being processed
+        flush_records (int): push after N buffered records
+        flush_bytes (int): push after M buffered bytes
+        compression (str): None, 'gzip' or 'zstd'
+    """
+    def __init__(self, queue, save_path: str, level: str, output_format: str='jsonl',
+                 shard: int=None, flush_records: int=1000, flush_bytes: int=16*1024*1024,
+                 compression: str=None):
+        self.queue = queue
+        self.save_path = save_path
+        self.output_format = output_format
+        self.shard = shard
+        self.flush_records = flush_records
+        self.flush_bytes = flush_bytes
+
+        self.buffer = []
+        self.buffer_size = 0
+        self.n_record = 0
+        self.n_bytes = 0
+        kwargs = {'flush_records': flush_records, 'flush_bytes': flush_bytes, 'compression': compression}
+        self.queue.put(('open', shard, save_path, (level, output_format, kwargs)))
+
+    def write(self, item):
+        buffer_size = self.buffer_size
+        if self.output_format == 'jsonl':
+            item = dumps_bytes(item) + b'\n'
+            self.buffer_size += len(item)
+        else:
+            self.buffer_size += len(item.get('code') or '')
+        self.buffer.append(item)
+        self.n_record += 1
+        self.n_bytes += self.buffer_size - buffer_size
+
+        if len(self.buffer) >= self.flush_records or self.buffer_size >= self.flush_bytes:
+            self.flush()
+
+    def extend(self, items):
+        for item in items:
+            self.write(item)
+
+    def flush(self):
+        if self.buffer:
+            payload = b''.join(self.buffer) if self.output_format == 'jsonl' else self.buffer
+            self.queue.put(('write', self.shard, self.save_path, (payload, len(self.buffer))))
+        self.buffer = []
+        self.buffer_size = 0
+
+    def close(self):
+        """Push the remaining records, the writer process returns the index entry"""
+        self.flush()
+        self.queue.put(('close', self.shard, self.save_path, None))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RotatingWriter:
+    """
+    Split an output into parts of at most `max_records` records or about
+    `max_bytes` bytes (uncompressed .jsonl lines, code length for .parquet),
+    named `<save_path>_00000`, `<save_path>_00001`, ... The next part is only
+    opened on the following record, so there is no empty trailing part.
+    Without limit, there is a single part named `<save_path>`. `outputs`
+    holds the index entries of the closed parts (see `get_output_entry`).
+
+    Args:
+        open_writer (Callable): create the writer of a part from its path
+            (without extension), e.g. `get_writer` or `QueueWriter`
+        save_path (str): output path without extension
+        max_records (int): rotate after N records
+        max_bytes (int): rotate after M bytes
+    """
+    def __init__(self, open_writer, save_path: str, max_records: int=None, max_bytes: int=None):
+        self.open_writer = open_writer
+        self.save_path = save_path
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.rotate = bool(max_records or max_bytes)
+
+        self.part = 0
+        self.n_record = 0
+        self.outputs = []
+        self.writer = self._open()
+
+    def _open(self):
+        part_path = f'{self.save_path}_{self.part:05d}' if self.rotate else self.save_path
+        self.part += 1
+        return self.open_writer(part_path)
+
+    def _close(self):
+        entry = self.writer.close()
+        if entry is not None:
+            self.outputs.append(entry)
+        self.writer = None
+
+    def write(self, item):
+        if self.writer is None:
+            self.writer = self._open()
+        self.writer.write(item)
+        self.n_record += 1
+
+        if self.rotate and ((self.max_records and self.writer.n_record >= self.max_records)
+                            or (self.max_bytes and self.writer.n_bytes >= self.max_bytes)):
+            self._close()
+
+    def extend(self, items):
+        for item in items:
+            self.write(item)
+
+    def close(self) -> List[Dict]:
+        if self.writer is not None:
+            self._close()
+        return self.outputs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_shard_index(save_path: str, entries: List[Dict]):
+    """
+    Write an `index.json` in each level folder of `save_path` listing its
+    output files with their number of records, size and checksum, so later
+    stages can plan their work without reading the outputs
+
+    Args:
+        save_path (str): output folder
+        entries (List[Dict]): index entries (see `get_output_entry`), with
+            `path` relative to `save_path` (`[<language>/]<level>/<set>/<file>`)
+            and `shard` the input shard
+    """
+    levels = {}
+    for entry in entries:
+        level_path, filename = os.path.split(entry['path'])
+        level_path, set_name = os.path.split(level_path)
+        levels.setdefault(level_path, []).append({**entry, 'set': set_name, 'path': f'{set_name}/{filename}'})
+
+    for level_path, level_entries in levels.items():
+        level_entries.sort(key=lambda entry: (entry['set'], entry['shard'], entry['path']))
+        index = {
+            'records': {set_name: sum(entry['records'] for entry in level_entries if entry['set'] == set_name)
+                        for set_name in dict.fromkeys(entry['set'] for entry in level_entries)},
+            'shards': level_entries,
+        }
+        index_path = os.path.join(save_path, level_path, 'index.json')
+        with open(index_path + '.tmp', 'w') as file:
+            json.dump(index, file, indent=1)
+        os.replace(index_path + '.tmp', index_path)
+
+
+def run_writer_process(queue, done_queue):
+    """
+    Writer process of the asynchronous writer mode. Handle the messages of
+    `QueueWriter` (open, write, close) until `None`, and put `(shard, ok)`
+    into `done_queue` on a `done` message, i.e. once every output of the
+    shard is closed (renamed to its final name), along with the index entries of
+    its outputs. A shard is not ok if any of its outputs failed, the error is
+    logged and the other shards go on.
+
+    Args:
+        queue (multiprocessing.Queue): (action, shard, save_path, args) messages
+        done_queue (multiprocessing.Queue): `(shard, ok, entries)` of the
+            completed shards, `None` at exit
+    """
+    writers = {}
+    failed = set()
+    entries = {}
+    while True:
+        message = queue.get()
+        if message is None:
+            break
+        action, shard, save_path, args = message
+        try:
+            if action == 'open':
+                level, output_format, kwargs = args
+                writers[save_path] = get_writer(save_path, level, output_format=output_format, **kwargs)
+            elif action == 'write':
+                payload, n_record = args
+                if isinstance(payload, bytes):
+                    writers[save_path].write_lines(payload, n_record)
+                else:
+                    writers[save_path].extend(payload)
+            elif action == 'close':
+                entry = writers.pop(save_path).close()
+                if entry is not None:
+                    entries.setdefault(shard, []).append(entry)
+            elif action == 'done':
+                done_queue.put((shard, shard not in failed, entries.pop(shard, [])))
+                failed.discard(shard)
+        except Exception as e:
+            logger.error(f"Writer process failed to {action} {save_path}: {e}")
+            failed.add(shard)
+            writers.pop(save_path, None)
+    done_queue.put(None)
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.utils.cache import DocstringCache, ExtractionCache, get_blob_hexsha
+
+
+ROOT_PATH = str(Path(__file__).parents[1])
+
+
+class Test_Extraction_Cache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ExtractionCache(os.path.join(self.tmp_dir.name, 'cache.sqlite'), flush_records=2)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        metadata = {'repo': 'a/b', 'path': 'x.py', 'language': 'Python'}
+        records = [{'identifier': 'f', **metadata, 'code': 'def f(): pass'}]
+        hexsha = get_blob_hexsha(b'def f(): pass')
+        self.cache.put(hexsha, 'python', 'function', 'v1', records, metadata)
+        self.cache.flush()
+
+        new_metadata = {'repo': 'c/d', 'path': 'y.py', 'language': 'Python'}
+        cached = self.cache.get(hexsha, 'python', 'function', 'v1', new_metadata)
+        self.assertEqual(cached, [{'identifier': 'f', **new_metadata, 'code': 'def f(): pass'}])
+        self.assertEqual(list(cached[0]), list(records[0]))
+        self.assertIsNone(self.cache.get(hexsha, 'python', 'function', 'v2', new_metadata))
+        self.assertIsNone(self.cache.get(hexsha, 'python', 'class', 'v1', new_metadata))
+
+    @unittest.skipUnless(os.path.exists(os.path.join(ROOT_PATH, 'tree-sitter', 'python.so')),
+                         "tree-sitter Python language is not built")
+    def test_raw_format(self):
+        from codetext.parser import PythonParser
+        from src.utils import parse_code, process_raw_node
+        from src.utils.reader import load_data_format
+
+        # a CodeSearchNet row: `code_tokens`, `comment`, ... are also node fields
+        code = ('def add(a, b):\n    """Add two numbers."""\n'
+                '    # sum\n    c = a + b\n    d = c * 1\n    return d\n')
+        row = {'code': code, 'repo': 'a/b', 'path': 'x.py', 'language': 'Python', 'identifier': 'add',
+               'parameters': ['a', 'b'], 'code_tokens': ['row'], 'original_docstring': 'row', 'comment': []}
+        _, data_fields = load_data_format(os.path.join(ROOT_PATH, 'data', 'format', 'raw-format.yaml'))
+        metadata = {key: row[source_key] for key, source_key in data_fields}
+
+        records = list(process_raw_node(parse_code(code, 'python'), code, PythonParser(), metadata))
+        hexsha = get_blob_hexsha(bytes(code, 'utf8'))
+        self.cache.put(hexsha, 'python', 'function', 'v1', records, metadata)
+        self.cache.flush()
+
+        uncached = list(process_raw_node(parse_code(code, 'python'), code, PythonParser(), metadata))
+        cached = self.cache.get(hexsha, 'python', 'function', 'v1', metadata)
+        self.assertEqual(len(uncached), 1)
+        self.assertEqual(cached, uncached)
+        self.assertEqual([list(record) for record in cached], [list(record) for record in uncached])
+
+    def test_blob_hexsha(self):
+        # `git hash-object` of an empty file
+        self.assertEqual(get_blob_hexsha(b''), 'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391')
+
+
+class Test_Docstring_Cache(unittest.TestCase):
+    def test_lru(self):
+        cache = DocstringCache(max_entries=2)
+        calls = []
+        compute = lambda value: lambda: calls.append(value) or value
+
+        self.assertEqual(cache.get(('a', 'python', ['x']), compute(1)), 1)
+        self.assertEqual(cache.get(('a', 'python', ['x']), compute(2)), 1)
+        self.assertEqual(cache.get(('a', 'python', ['y']), compute(3)), 3)
+        self.assertIsNone(cache.get(('b', 'python', []), compute(None)))
+        self.assertIsNone(cache.get(('b', 'python', []), compute(4)))
+        # ('a', ['x']) is the least recently used, evicted by ('b', [])
+        self.assertEqual(cache.get(('a', 'python', ['x']), compute(5)), 5)
+        self.assertEqual(calls, [1, 3, None, 5])
+        counts = cache.pop_counts()
+        self.assertEqual({name: counts[name] for name in ['hit', 'miss', 'evict']},
+                         {'hit': 2, 'miss': 4, 'evict': 2})
+        self.assertGreater(counts['miss_s'], 0.)
+        self.assertEqual(cache.pop_counts(), {'hit': 0, 'miss': 0, 'evict': 0, 'miss_s': 0.})
+
+    def test_max_chars(self):
+        cache = DocstringCache(max_chars=40)
+        cache.get(('x' * 20,), lambda: 1)
+        cache.get(('y' * 20,), lambda: 2)
+        self.assertEqual(len(cache.entries), 1)
+        self.assertLessEqual(cache.n_char, 40)
+        cache.get(('z' * 100,), lambda: 3)  # larger than the cache, not kept
+        self.assertEqual(len(cache.entries), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
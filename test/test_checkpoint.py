@@ -0,0 +1,52 @@
+import os
+import json
+import tempfile
+import unittest
+
+from src.utils.checkpoint import Manifest, get_signature
+
+
+class Test_Manifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, 'manifest_function.jsonl')
+        self.signature = get_signature('function', ['python'], 'data.jsonl', None, None, [(0, 10), (10, 20)])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_resume(self):
+        manifest = Manifest(self.filepath, self.signature)
+        manifest.add(0, [1, 1, 1], outputs=[{'path': 'function/raw/batch_0_function.jsonl'}])
+        manifest.close()
+
+        manifest = Manifest(self.filepath, self.signature, resume=True)
+        self.assertTrue(manifest.is_completed(0))
+        self.assertFalse(manifest.is_completed(1))
+        self.assertEqual(manifest.outputs[0], [{'path': 'function/raw/batch_0_function.jsonl'}])
+        manifest.close()
+
+        with self.assertRaises(ValueError):
+            Manifest(self.filepath, get_signature('function', ['python'], 'data.jsonl', None, None, [(0, 20)]),
+                     resume=True)
+
+    def test_truncated_line(self):
+        manifest = Manifest(self.filepath, self.signature)
+        manifest.add(0, [1, 1, 1])
+        manifest.close()
+        # killed while recording shard 1
+        with open(self.filepath, 'a') as file:
+            file.write('{"shard": 1, "resu')
+
+        manifest = Manifest(self.filepath, self.signature, resume=True)
+        self.assertEqual(manifest.completed, {0: [1, 1, 1]})
+        manifest.add(1, [2, 2, 2])
+        manifest.close()
+
+        with open(self.filepath, 'r') as file:
+            lines = [json.loads(line) for line in file]
+        self.assertEqual([line.get('shard') for line in lines], [None, 0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
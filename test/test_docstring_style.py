@@ -0,0 +1,30 @@
+import unittest
+
+from codetext.utils import module_available
+
+
+@unittest.skipUnless(module_available("docstring_parser"), "`docstring_parser` is not available")
+class Test_Docstring_Style(unittest.TestCase):
+    def test_detect_style(self):
+        from src.utils import STYLE_MAP, DocstringStyle, detect_docstring_style
+
+        styles = STYLE_MAP['python']
+        self.assertEqual(detect_docstring_style('Add.\n\n:param a: first', styles), DocstringStyle.REST)
+        self.assertEqual(detect_docstring_style('Add.\n\nArgs:\n    a: first', styles), DocstringStyle.GOOGLE)
+        self.assertEqual(detect_docstring_style('Add.\n\nParameters\n----------\na : int', styles),
+                         DocstringStyle.NUMPYDOC)
+        self.assertEqual(detect_docstring_style('Add.\n\n@param a: first', styles), DocstringStyle.EPYDOC)
+        self.assertEqual(detect_docstring_style('Add two numbers.', styles), DocstringStyle.REST)
+        # ambiguous
+        self.assertIsNone(detect_docstring_style('Add.\n\nArgs:\n    a: first\n:param a: first', styles))
+
+    def test_parse_docstring(self):
+        from src.utils import STYLE_MAP, parse_docstring
+
+        ret = parse_docstring('Add.\n\nArgs:\n    a (int): first\n\nReturns:\n    int: sum', STYLE_MAP['python'])
+        self.assertEqual([param.arg_name for param in ret.params], ['a'])
+        self.assertEqual(ret.returns.type_name, 'int')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,19 @@
+import io
+import unittest
+
+from src.utils.io import dump_line, dumps_bytes, loads
+
+
+class Test_Json_Codec(unittest.TestCase):
+    def test_lone_surrogate(self):
+        # scraped code may hold lone surrogates, they are written escaped
+        item = {'code': 'x = "\ud800"', 'docstring': 'Résumé'}
+        self.assertEqual(loads(dumps_bytes(item)), item)
+
+        file = io.StringIO()
+        dump_line(item, file)
+        self.assertEqual(loads(file.getvalue()), item)
+
+
+if __name__ == '__main__':
+    unittest.main()
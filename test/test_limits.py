@@ -0,0 +1,89 @@
+import os
+import time
+import unittest
+from pathlib import Path
+
+from tree_sitter import Language, Parser
+
+from src.utils.limits import FileTimeout, get_tree_depth, parse_with_limits, time_limit
+
+
+LANGUAGE_PATH = os.path.join(str(Path(__file__).parents[1]), 'tree-sitter', 'python.so')
+
+
+@unittest.skipUnless(os.path.exists(LANGUAGE_PATH), "tree-sitter Python language is not built")
+class Test_Parse_Limits(unittest.TestCase):
+    def setUp(self):
+        self.parser = Parser()
+        self.parser.set_language(Language(LANGUAGE_PATH, 'python'))
+
+    def test_no_limit(self):
+        tree, reason = parse_with_limits(self.parser, b'def f(a):\n    return a\n')
+        self.assertIsNotNone(tree)
+        self.assertIsNone(reason)
+
+    def test_max_bytes(self):
+        tree, reason = parse_with_limits(self.parser, b'x = 1\n' * 100, max_bytes=100)
+        self.assertIsNone(tree)
+        self.assertEqual(reason, 'max_bytes')
+
+    def test_max_depth(self):
+        code = b'x = ' + b'[' * 200 + b']' * 200 + b'\n'
+        self.assertGreater(get_tree_depth(self.parser.parse(code)), 200)
+        self.assertEqual(get_tree_depth(self.parser.parse(code), max_depth=50), 51)
+        tree, reason = parse_with_limits(self.parser, code, max_depth=100)
+        self.assertIsNone(tree)
+        self.assertEqual(reason, 'max_depth')
+
+
+class CancelledParser:
+    """Parser with the timeout API whose parses are cancelled"""
+    def __init__(self):
+        self.timeouts, self.n_reset = [], 0
+
+    def set_timeout_micros(self, timeout_micros):
+        self.timeouts.append(timeout_micros)
+
+    def parse(self, code):
+        return None
+
+    def reset(self):
+        self.n_reset += 1
+
+
+class Test_Parse_Timeout(unittest.TestCase):
+    def test_cancelled(self):
+        parser = CancelledParser()
+        tree, reason = parse_with_limits(parser, b'x = 1\n', parse_timeout=0.5)
+        self.assertIsNone(tree)
+        self.assertEqual(reason, 'parse_timeout')
+        self.assertEqual(parser.n_reset, 1)
+        # the timeout of the previous call is cleared
+        parse_with_limits(parser, b'x = 1\n')
+        self.assertEqual(parser.timeouts, [500000, 0])
+
+
+class Test_Time_Limit(unittest.TestCase):
+    def test_timeout(self):
+        start = time.perf_counter()
+        with self.assertRaises(FileTimeout):
+            with time_limit(0.05):
+                # not swallowed by the `except Exception` of the extraction code
+                try:
+                    while True:
+                        pass
+                except Exception:
+                    pass
+        self.assertLess(time.perf_counter() - start, 1.)
+
+    def test_no_timeout(self):
+        with time_limit(1.):
+            pass
+        with time_limit(None):
+            time.sleep(0.01)
+        # the alarm is cleared when leaving the block
+        time.sleep(1.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import unittest
+import threading
+from pathlib import Path
+
+from src.utils import get_ts_language, get_ts_parser, parse_code, parse_many
+
+
+LANGUAGE_PATH = os.path.join(str(Path(__file__).parents[1]), 'tree-sitter', 'python.so')
+C_LANGUAGE_PATH = os.path.join(str(Path(__file__).parents[1]), 'tree-sitter', 'c.so')
+
+
+@unittest.skipUnless(os.path.exists(LANGUAGE_PATH), "tree-sitter Python language is not built")
+class Test_Parser_Registry(unittest.TestCase):
+    def test_cached(self):
+        self.assertIs(get_ts_language('Python'), get_ts_language('python'))
+        self.assertIs(get_ts_parser('Python'), get_ts_parser('python'))
+
+        parsers = []
+        thread = threading.Thread(target=lambda: parsers.append(get_ts_parser('python')))
+        thread.start()
+        thread.join()
+        self.assertIsNot(parsers[0], get_ts_parser('python'))
+
+    def test_parse_many(self):
+        codes = ['def f():\n    pass\n', 'x = 1\n']
+        trees = parse_many(codes, 'Python')
+        self.assertEqual([tree.root_node.sexp() for tree in trees],
+                         [parse_code(code, 'Python').root_node.sexp() for code in codes])
+        self.assertEqual(trees[0].root_node.children[0].type, 'function_definition')
+
+
+@unittest.skipUnless(os.path.exists(C_LANGUAGE_PATH), "tree-sitter C language is not built")
+class Test_Line_Definitions(unittest.TestCase):
+    def test_missing_node(self):
+        from codetext.parser import CppParser
+        from src.utils import get_line_definitions
+
+        code = ('int check(int a)\n'
+                '{\n'
+                '   int b = a;\n'
+                '   if (/* always taken for now */\n'
+                '       )\n'
+                '      b = 1;\n'
+                '   return b;\n'
+                '}\n')
+        tree = parse_code(code, 'c')
+        # the condition is `(comment) (MISSING identifier)`, the context stops at the MISSING node
+        self.assertIn('(MISSING identifier)', tree.root_node.sexp())
+        lines = list(get_line_definitions(tree, code, CppParser(), {}))
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['prev_context']['code'], '(')
+        self.assertEqual(lines[0]['next_context'],
+                         {'code': '', 'start_point': [3, 33], 'end_point': [3, 33]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import json
+import tempfile
+import unittest
+
+from src.utils.reader import _PYARROW_AVAILABLE, get_jsonl_shards, get_parquet_shards,\
+    read_jsonl_shard, read_parquet_shard
+
+
+class Test_Jsonl_Shard(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, 'data.jsonl')
+        self.samples = [{'id': idx, 'code': 'x' * (idx % 7) * 10} for idx in range(100)]
+        with open(self.filepath, 'w') as file:
+            for item in self.samples:
+                file.write(json.dumps(item) + '\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_shards_cover_all_lines(self):
+        for n_split in [1, 3, 7, 100, 1000]:
+            shards = get_jsonl_shards(self.filepath, n_split)
+            samples = [item for shard in shards for item in read_jsonl_shard(*shard)]
+            self.assertEqual(samples, self.samples)
+
+    def test_n_sample(self):
+        shards = get_jsonl_shards(self.filepath, 4, n_sample=10)
+        samples = [item for shard in shards for item in read_jsonl_shard(*shard)]
+        self.assertEqual(samples, self.samples[:10])
+
+
+@unittest.skipUnless(_PYARROW_AVAILABLE, "`pyarrow` is not installed")
+class Test_Parquet_Shard(unittest.TestCase):
+    def setUp(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.samples = [{'id': idx, 'code': 'x' * idx, 'unused': idx} for idx in range(50)]
+        table = pa.Table.from_pylist(self.samples)
+        pq.write_table(table.slice(0, 20), os.path.join(self.tmp_dir.name, 'a.parquet'), row_group_size=6)
+        pq.write_table(table.slice(20), os.path.join(self.tmp_dir.name, 'b.parquet'), row_group_size=6)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_row_group_shards(self):
+        shards = get_parquet_shards(self.tmp_dir.name)
+        self.assertEqual(len(shards), 4 + 5)
+        samples = [item for shard in shards for item in read_parquet_shard(*shard, columns=['id', 'code'])]
+        self.assertEqual(samples, [{'id': item['id'], 'code': item['code']} for item in self.samples])
+
+    def test_n_sample(self):
+        shards = get_parquet_shards(self.tmp_dir.name, n_sample=23)
+        samples = [item for shard in shards for item in read_parquet_shard(*shard)]
+        self.assertEqual(samples, self.samples[:23])
+
+
+if __name__ == '__main__':
+    unittest.main()
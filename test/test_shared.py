@@ -0,0 +1,39 @@
+import os
+import json
+import pickle
+import tempfile
+import unittest
+
+from src.utils.shared import SharedLineIndex, build_line_offsets
+
+
+class Test_Shared_Line_Index(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp_dir.name, 'data.jsonl')
+        self.samples = [{'id': idx, 'code': 'x' * (idx % 7) * 10} for idx in range(100)]
+        with open(self.filepath, 'w') as file:
+            file.write('\n'.join(json.dumps(item) for item in self.samples))  # no trailing newline
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_offsets(self):
+        offsets = build_line_offsets(self.filepath, chunk_size=64)
+        self.assertEqual(len(offsets), len(self.samples) + 1)
+        self.assertEqual(offsets[-1], os.path.getsize(self.filepath))
+        self.assertEqual(len(build_line_offsets(self.filepath, n_sample=10)), 11)
+
+    def test_read_from_pickled_handle(self):
+        index = SharedLineIndex(self.filepath)
+        try:
+            handle = pickle.loads(pickle.dumps(index))
+            samples = list(handle.read(0, 40)) + list(handle.read(40, len(handle)))
+            self.assertEqual(samples, self.samples)
+            handle.close()
+        finally:
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
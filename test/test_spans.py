@@ -0,0 +1,50 @@
+import os
+import unittest
+from pathlib import Path
+
+from src.utils.spans import count_code_lines, find_comment_spans, remove_spans
+
+
+LANGUAGE_PATH = os.path.join(str(Path(__file__).parents[1]), 'tree-sitter', 'python.so')
+
+
+class Test_Comment_Spans(unittest.TestCase):
+    def test_count_code_lines(self):
+        code = ('int f(int a) {\n'
+                '    /* first\n'
+                '       second */\n'
+                '    int b = a; // note\n'
+                '\n'
+                '    return b;\n'
+                '}')
+        self.assertEqual(count_code_lines(code, [(1, 2), (3, 3)]), 3)
+        self.assertEqual(count_code_lines(code, []), 6)
+
+    def test_remove_comments(self):
+        code = 'x = 1  # note 1\ny = 2  # note 10\n# note 1\n'
+        comments = ['# note 1', '# note 10', '# note 1']
+        spans = find_comment_spans(code, comments)
+        self.assertEqual(len(spans), 3)
+        self.assertEqual(remove_spans(code, spans), 'x = 1  \ny = 2  \n\n')
+
+
+@unittest.skipUnless(os.path.exists(LANGUAGE_PATH), "tree-sitter Python language is not built")
+class Test_Raw_Node_Lines(unittest.TestCase):
+    def test_multiline_docstring(self):
+        from codetext.parser import PythonParser
+        from src.utils import parse_code, process_raw_node
+
+        # one statement under a multi-line docstring: the docstring lines count as code
+        code = ('class Client:\n'
+                '    def slave(self):\n'
+                '        """Process a SLAVE command.\n'
+                '\n'
+                '        Returns the response."""\n'
+                '        return self._shortcmd(\'SLAVE\')\n')
+        metadata = {'repo': 'owner/repo', 'path': 'client.py', 'language': 'Python'}
+        nodes = list(process_raw_node(parse_code(code, 'python'), code, PythonParser(), metadata))
+        self.assertEqual([node['identifier'] for node in nodes], ['slave'])
+
+
+if __name__ == '__main__':
+    unittest.main()
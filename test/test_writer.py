@@ -0,0 +1,65 @@
+import os
+import json
+import hashlib
+import queue
+import tempfile
+import unittest
+from functools import partial
+
+from src.utils.writer import QueueWriter, RotatingWriter, get_writer, run_writer_process
+
+
+class Test_Queue_Writer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_writer_process(self):
+        messages, done = queue.Queue(), queue.Queue()
+        save_path = os.path.join(self.tmp_dir.name, 'batch_0_function')
+        samples = [{'id': idx, 'code': 'é' * idx} for idx in range(25)]
+
+        writer = QueueWriter(messages, save_path, 'function', shard=0, flush_records=10)
+        writer.extend(samples)
+        writer.close()
+        messages.put(('done', 0, None, None))
+        messages.put(None)
+        run_writer_process(messages, done)
+
+        self.assertEqual(writer.n_record, 25)
+        shard, ok, entries = done.get()
+        self.assertEqual((shard, ok), (0, True))
+        self.assertEqual([entry['records'] for entry in entries], [25])
+        self.assertIsNone(done.get())
+        with open(save_path + '.jsonl', 'r') as file:
+            self.assertEqual([json.loads(line) for line in file], samples)
+
+    def test_failed_shard(self):
+        messages, done = queue.Queue(), queue.Queue()
+        messages.put(('write', 1, 'not_opened', (b'{}\n', 1)))
+        messages.put(('done', 1, None, None))
+        messages.put(None)
+        run_writer_process(messages, done)
+        self.assertEqual(done.get(), (1, False, []))
+
+    def test_rotation(self):
+        save_path = os.path.join(self.tmp_dir.name, 'batch_0_function')
+        writer = RotatingWriter(partial(get_writer, level='function'), save_path, max_records=10)
+        writer.extend({'id': idx} for idx in range(25))
+        entries = writer.close()
+
+        self.assertEqual(writer.n_record, 25)
+        self.assertEqual([os.path.basename(entry['path']) for entry in entries],
+                         ['batch_0_function_00000.jsonl', 'batch_0_function_00001.jsonl',
+                          'batch_0_function_00002.jsonl'])
+        self.assertEqual([entry['records'] for entry in entries], [10, 10, 5])
+        with open(entries[1]['path'], 'rb') as file:
+            content = file.read()
+        self.assertEqual(entries[1]['bytes'], len(content))
+        self.assertEqual(entries[1]['sha256'], hashlib.sha256(content).hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()